@@ -1,14 +1,12 @@
 import streamlit as st
-import tempfile
 import os
-from PIL import Image, ImageDraw, ImageFont
-import base64
+import hashlib
 from pathlib import Path
 
 # Import your modules
 from src.vision_search.config import load_config
-from src.vision_search.inference import YOLOv11Inference
-from src.vision_search.utils import save_metadata, load_metadata, get_unique_classes_counts
+from src.vision_search.render import renderer_from_config
+from src.vision_search.registry import get_inferencer_from_config, preload_from_config
 
 # Load config
 try:
@@ -19,16 +17,22 @@ except FileNotFoundError:
     st.error("Config file not found!")
     st.stop()
 
-def img_to_base64(image):
-    import io
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode()
-
 # Page config
 st.set_page_config(page_title="Vision Search", layout="wide")
 st.title("🔍 Vision Search - Object Detection")
 
+renderer = renderer_from_config(CONFIG)
+
+# Load and warm up the model in the background, once per server process, while the page renders
+preload_from_config(CONFIG)
+
+
+def load_inferencer():
+    """The shared, warmed-up model; waits for the background load if it is still running."""
+    with st.spinner("Loading AI model..."):
+        return get_inferencer_from_config(CONFIG)
+
+
 # Sidebar
 st.sidebar.title("📁 Image Input")
 option = st.sidebar.radio("Choose method:", ["Upload Image", "Enter Path"])
@@ -42,26 +46,20 @@ if option == "Upload Image":
     uploaded_file = st.sidebar.file_uploader("Choose image", type=['jpg', 'jpeg', 'png', 'bmp'])
     
     if uploaded_file is not None:
-        # Save to temp file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            temp_path = tmp_file.name
-        
         st.sidebar.success("✅ File uploaded!")
         
         if st.sidebar.button("🔍 Analyze Image"):
             try:
-                # Load model
-                with st.spinner("Loading AI model..."):
-                    inferencer = YOLOv11Inference(
-                        model_path='yolo11m.pt',
-                        conf_threshold=0.25,
-                        image_extensions=['.jpg', '.jpeg', '.png']
-                    )
+                inferencer = load_inferencer()
+                # Decode the upload once, reduced only as far as the model and display allow;
+                # the same array feeds the model and the drawing
+                data = uploaded_file.getvalue()
+                image, full_size = inferencer.decode(data, renderer.max_size)
+                content_hash = hashlib.sha256(data).hexdigest()
                 
                 # Process image
-                with st.spinner("Analyzing image..."):
-                    result = inferencer.process_single_image(temp_path)
+                with st.spinner("Analyzing image..."), inferencer.metrics.collect() as timings:
+                    result = inferencer.process_single_image(image, uploaded_file.name, content_hash, full_size)
                 
                 st.write(f"Debug: Result = {result}")
                 
@@ -69,29 +67,21 @@ if option == "Upload Image":
                     # Display results
                     st.success(f"✨ Found {len(result['detections'])} objects!")
                     
-                    # Show image with boxes
-                    img = Image.open(temp_path)
-                    draw = ImageDraw.Draw(img)
-                    
-                    for det in result['detections']:
-                        bbox = det['bbox']
-                        draw.rectangle(bbox, outline="red", width=2)
-                        draw.text((bbox[0], bbox[1]-15), f"{det['class']} {det['confidence']:.2f}", fill="red")
-                    
-                    st.image(img, caption="Detection Results", use_column_width=True)
+                    # Show image with boxes, drawn on a display-sized copy
+                    rendered = renderer.render(image, result['detections'], content_hash, image_size=full_size)
+                    st.image(rendered, caption="Detection Results", use_column_width=True)
                     
                     # Show detection details
                     st.subheader("📊 Detection Details")
                     for det in result['detections']:
                         st.write(f"- **{det['class']}**: {det['confidence']:.2f} confidence")
                 
-                # Cleanup
-                os.unlink(temp_path)
+                # Stage timings of this analysis only, in milliseconds
+                with st.expander("⏱️ Timings"):
+                    st.json({stage: round(ms, 2) for stage, ms in timings.items()})
                 
             except Exception as e:
                 st.error(f"Error: {str(e)}")
-                if os.path.exists(temp_path):
-                    os.unlink(temp_path)
 
 else:
     st.sidebar.subheader("📝 Enter Path")
@@ -100,35 +90,33 @@ else:
     if st.sidebar.button("🔍 Analyze Image") and image_path:
         if os.path.exists(image_path):
             try:
-                # Load model and process
-                with st.spinner("Processing..."):
-                    inferencer = YOLOv11Inference(
-                        model_path='yolo11m.pt',
-                        conf_threshold=0.25,
-                        image_extensions=['.jpg', '.jpeg', '.png']
-                    )
-                    result = inferencer.process_single_image(image_path)
+                inferencer = load_inferencer()
+                # Decoded once, for both the model and the drawing (reduced only as far as both allow)
+                data = Path(image_path).read_bytes()
+                image, full_size = inferencer.decode(data, renderer.max_size)
+                content_hash = hashlib.sha256(data).hexdigest()
+                
+                # Process
+                with st.spinner("Processing..."), inferencer.metrics.collect() as timings:
+                    result = inferencer.process_single_image(image, image_path, content_hash, full_size)
                 
                 st.write(f"Debug: Result = {result}")
                 
                 if result and result.get('detections'):
                     st.success(f"✨ Found {len(result['detections'])} objects!")
                     
-                    # Show image with boxes
-                    img = Image.open(image_path)
-                    draw = ImageDraw.Draw(img)
-                    
-                    for det in result['detections']:
-                        bbox = det['bbox']
-                        draw.rectangle(bbox, outline="red", width=2)
-                        draw.text((bbox[0], bbox[1]-15), f"{det['class']} {det['confidence']:.2f}", fill="red")
-                    
-                    st.image(img, caption="Detection Results", use_column_width=True)
+                    # Show image with boxes, drawn on a display-sized copy
+                    rendered = renderer.render(image, result['detections'], content_hash, image_size=full_size)
+                    st.image(rendered, caption="Detection Results", use_column_width=True)
                     
                     # Show details
                     st.subheader("📊 Detection Details")
                     for det in result['detections']:
                         st.write(f"- **{det['class']}**: {det['confidence']:.2f} confidence")
+                
+                # Stage timings of this analysis only, in milliseconds
+                with st.expander("⏱️ Timings"):
+                    st.json({stage: round(ms, 2) for stage, ms in timings.items()})
                         
             except Exception as e:
                 st.error(f"Error: {str(e)}")
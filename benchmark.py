@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""Throughput/latency benchmark for the inference and metadata paths.
+
+Runs offline on CPU against either a deterministic stub detector (the
+default) or any model path ultralytics can build, e.g. `yolo11n.yaml` for
+a tiny randomly initialised network. Results are written as JSON so runs
+can be compared:
+
+    python benchmark.py --output bench_results.json
+    python benchmark.py --model yolo11n.yaml --num-images 32 --sizes 640x480
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from src.vision_search.inference import YOLOv11Inference
+from src.vision_search.index import MetadataIndex, Term
+from src.vision_search.pipeline import iter_prefetched
+from src.vision_search.utils import find_images, save_metadata, load_metadata, get_unique_classes_counts
+
+STUB_CLASSES = ['person', 'car', 'dog', 'cat', 'bicycle', 'bus', 'chair', 'bottle']
+
+
+class StubDetector:
+    """Deterministic stand-in for `ultralytics.YOLO`.
+
+    Boxes depend only on the image pixels, so two runs over the same images
+    give identical metadata. `call_ms`/`image_ms` simulate the per-call and
+    per-image cost of a forward pass.
+    """
+
+    def __init__(self, boxes_per_image=8, call_ms=0.0, image_ms=0.0):
+        self.names = dict(enumerate(STUB_CLASSES))
+        self.boxes_per_image = boxes_per_image
+        self.call_ms = call_ms
+        self.image_ms = image_ms
+
+    def to(self, device):
+        return self
+
+    def predict(self, source, conf=0.25, device=None, **kwargs):
+        import torch
+        from ultralytics.engine.results import Results
+
+        sources = source if isinstance(source, (list, tuple)) else [source]
+        time.sleep((self.call_ms + self.image_ms * len(sources)) / 1000)
+
+        results = []
+        for src in sources:
+            image = src if isinstance(src, np.ndarray) else cv2.imread(str(src))
+            if image is None:
+                raise ValueError(f"cannot identify image file {src}")
+            h, w = image.shape[:2]
+            rng = np.random.default_rng(int(image[::16, ::16].sum()) % (2 ** 32))
+
+            n = self.boxes_per_image
+            xy = rng.random((n, 2)) * [w * 0.8, h * 0.8]
+            wh = rng.random((n, 2)) * [w * 0.2, h * 0.2] + 1
+            scores = rng.random(n)
+            classes = rng.integers(0, len(self.names), n)
+            data = np.column_stack([xy, xy + wh, scores, classes])[scores >= conf]
+
+            results.append(Results(
+                image,
+                path=str(src),
+                names=self.names,
+                boxes=torch.from_numpy(data.astype(np.float32))
+            ))
+        return results
+
+
+def make_inferencer(args):
+    if args.model != 'stub':
+        return YOLOv11Inference(args.model, args.conf, ['.jpg'], batch_size=args.batch_size, backend=args.backend)
+
+    class StubInference(YOLOv11Inference):
+        def _load_model(self, model_path):
+            return StubDetector(args.stub_boxes, args.stub_call_ms, args.stub_image_ms)
+
+    return StubInference('stub', args.conf, ['.jpg'], batch_size=args.batch_size)
+
+
+def generate_images(directory, sizes, num_images, seed=0):
+    """Writes `num_images` synthetic JPEGs, cycling through `sizes` ((w, h) tuples)."""
+    rng = np.random.default_rng(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for i in range(num_images):
+        w, h = sizes[i % len(sizes)]
+        # Smooth background plus a few solid shapes compresses like a photo
+        gx = np.linspace(0, 255, w, dtype=np.float32)
+        gy = np.linspace(0, 255, h, dtype=np.float32)[:, None]
+        image = np.stack([gx + 0 * gy, gy + 0 * gx, (gx + gy) / 2], axis=-1).astype(np.uint8)
+        for _ in range(5):
+            x0, y0 = int(rng.integers(0, w)), int(rng.integers(0, h))
+            x1, y1 = int(rng.integers(x0, w + 1)), int(rng.integers(y0, h + 1))
+            image[y0:y1, x0:x1] = rng.integers(0, 256, 3)
+        image = cv2.add(image, rng.integers(0, 16, image.shape, dtype=np.uint8))
+        cv2.imwrite(str(directory / f"synthetic_{i:05d}.jpg"), image)
+    return directory
+
+
+def peak_rss_mb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return usage / (1024 * 1024) if sys.platform == 'darwin' else usage / 1024
+
+
+def latency_summary(latencies, items=None, unit='images'):
+    """Throughput and latency percentiles; `items` is how many `unit`s the calls covered."""
+    latencies = np.asarray(latencies, dtype=np.float64)
+    total = float(latencies.sum())
+    items = len(latencies) if items is None else items
+    return {
+        'count': int(len(latencies)),
+        'total_s': total,
+        f'{unit}_per_sec': items / total if total else None,
+        'mean_ms': float(latencies.mean() * 1000) if len(latencies) else None,
+        'p50_ms': float(np.percentile(latencies, 50) * 1000) if len(latencies) else None,
+        'p95_ms': float(np.percentile(latencies, 95) * 1000) if len(latencies) else None,
+        'p99_ms': float(np.percentile(latencies, 99) * 1000) if len(latencies) else None
+    }
+
+
+def timed(fn, repeat=1):
+    """Runs `fn` `repeat` times and returns (last result, list of durations in seconds)."""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - start)
+    return result, durations
+
+
+def bench_process_image(inferencer, image_paths, warmup):
+    for img_path in image_paths[:warmup]:
+        inferencer.process_image(img_path)
+    latencies = []
+    for img_path in image_paths:
+        _, durations = timed(lambda: inferencer.process_image(img_path))
+        latencies.extend(durations)
+    return latency_summary(latencies)
+
+
+def bench_process_directory(inferencer, directory, num_images, repeat):
+    metadata, durations = timed(lambda: inferencer.process_directory(directory), repeat)
+    stage = latency_summary(durations, items=num_images * repeat)
+    stage['batch_size'] = inferencer.batch_size
+    return metadata, stage
+
+
+def bench_prefetch(inferencer, image_paths, repeat, prefetch, threads):
+    _, durations = timed(lambda: list(iter_prefetched(
+        inferencer, image_paths, prefetch=prefetch, num_threads=threads)), repeat)
+    stage = latency_summary(durations, items=len(image_paths) * repeat)
+    stage.update({'prefetch': prefetch, 'decode_threads': threads})
+    return stage
+
+
+def synthetic_metadata(metadata, records):
+    """Repeats real results under unique paths to reach `records` entries."""
+    out = []
+    for i in range(records):
+        item = dict(metadata[i % len(metadata)])
+        item['image_path'] = f"synthetic/{i:08d}.jpg"
+        out.append(item)
+    return out
+
+
+def bench_metadata(metadata, workdir, repeat):
+    stages = {}
+    for suffix in ('.json', '.jsonl', '.cols'):
+        path = Path(workdir) / f"metadata{suffix}"
+        _, save_durations = timed(lambda: save_metadata(metadata, path), repeat)
+        _, load_durations = timed(lambda: list(load_metadata(path)), repeat)
+        if path.is_dir():
+            size = sum(f.stat().st_size for f in path.iterdir())
+        else:
+            size = path.stat().st_size
+        stages[suffix.lstrip('.')] = {
+            'records': len(metadata),
+            'bytes': size,
+            'save': latency_summary(save_durations, len(metadata) * repeat, 'records'),
+            'load': latency_summary(load_durations, len(metadata) * repeat, 'records')
+        }
+    return stages
+
+
+def bench_facets(metadata, repeat):
+    _, scan = timed(lambda: get_unique_classes_counts(metadata), repeat)
+    index, build = timed(lambda: MetadataIndex.build(metadata), 1)
+    _, facets = timed(lambda: index.unique_classes_counts(), repeat)
+    query = (Term('person', min_count=2) & Term('car')) | ~Term('dog')
+    _, search = timed(lambda: index.search_ids(query), repeat)
+    n = len(metadata)
+    return {
+        'records': n,
+        'linear_scan': latency_summary(scan, n * repeat, 'records'),
+        'index_build': latency_summary(build, n, 'records'),
+        'index_facets': latency_summary(facets, unit='calls'),
+        'index_query': latency_summary(search, unit='calls')
+    }
+
+
+def environment():
+    env = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__
+    }
+    try:
+        import torch
+        env['torch'] = torch.__version__
+        env['torch_threads'] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return env
+
+
+def parse_sizes(text):
+    return [tuple(int(v) for v in size.lower().split('x')) for size in text.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='stub', help="'stub' or a model path/yaml for ultralytics")
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--backend', default='torch', choices=['torch', 'onnx'], help='ignored for the stub')
+    parser.add_argument('--num-images', type=int, default=64)
+    parser.add_argument('--sizes', default='640x480,1280x720,1920x1080', help='comma separated WxH list')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--prefetch', type=int, default=32)
+    parser.add_argument('--decode-threads', type=int, default=4)
+    parser.add_argument('--metadata-records', type=int, default=20000)
+    parser.add_argument('--stub-boxes', type=int, default=8)
+    parser.add_argument('--stub-call-ms', type=float, default=0.0)
+    parser.add_argument('--stub-image-ms', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--profile', action='store_true', help='cProfile + tracemalloc the directory run')
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args(argv)
+
+    report = {'environment': environment(), 'args': vars(args), 'stages': {}, 'peak_rss_mb': {}}
+    stages = report['stages']
+
+    def checkpoint(name):
+        report['peak_rss_mb'][name] = peak_rss_mb()
+        print(f"  {name}: done (peak RSS {report['peak_rss_mb'][name]:.0f} MB)")
+
+    with tempfile.TemporaryDirectory(prefix='vision_search_bench_') as workdir:
+        image_dir = generate_images(Path(workdir) / 'images', parse_sizes(args.sizes), args.num_images, args.seed)
+        image_paths = sorted(find_images(image_dir, ['.jpg']))
+        checkpoint('generate_images')
+
+        inferencer, load = timed(lambda: make_inferencer(args))
+        stages['model_load'] = latency_summary(load, unit='calls')
+        checkpoint('model_load')
+
+        stages['process_image'] = bench_process_image(inferencer, image_paths, args.warmup)
+        checkpoint('process_image')
+
+        metadata, stages['process_directory'] = bench_process_directory(
+            inferencer, image_dir, len(image_paths), args.repeat)
+        checkpoint('process_directory')
+
+        # Per-stage breakdown (read, decode, predict, parse, ...) of the runs above
+        report['inference_stages'] = inferencer.metrics.to_json()
+
+        if args.profile:
+            with inferencer.metrics.profile(cprofile=True, memory=True) as profile:
+                inferencer.process_directory(image_dir)
+            report['profile'] = profile
+
+        stages['prefetch_pipeline'] = bench_prefetch(
+            inferencer, image_paths, args.repeat, args.prefetch, args.decode_threads)
+        checkpoint('prefetch_pipeline')
+
+        records = synthetic_metadata(metadata, args.metadata_records) if metadata else []
+        stages['metadata'] = bench_metadata(records, workdir, args.repeat)
+        checkpoint('metadata')
+
+        stages['facets'] = bench_facets(records, args.repeat)
+        checkpoint('facets')
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    pi = stages['process_image']
+    print(f"\nprocess_image: {pi['images_per_sec']:.1f} img/s, "
+          f"p50 {pi['p50_ms']:.1f} ms, p95 {pi['p95_ms']:.1f} ms, p99 {pi['p99_ms']:.1f} ms")
+    print(f"process_directory: {stages['process_directory']['images_per_sec']:.1f} img/s")
+    print(f"prefetch_pipeline: {stages['prefetch_pipeline']['images_per_sec']:.1f} img/s")
+    print(f"Results written to {output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
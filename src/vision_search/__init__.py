@@ -1 +1,42 @@
 # This file makes 'vision_search' a Python package.
+# Names below resolve on first access, so `import src.vision_search` stays cheap and
+# torch/ultralytics load only when an inferencer is actually asked for.
+import importlib
+
+_EXPORTS = {
+    'YOLOv11Inference': 'inference',
+    'get_inferencer': 'registry',
+    'get_inferencer_from_config': 'registry',
+    'load_config': 'config',
+    'load_metadata': 'utils',
+    'save_metadata': 'utils',
+    'MetadataIndex': 'index',
+    'Term': 'index',
+    'And': 'index',
+    'Or': 'index',
+    'Not': 'index',
+    'Region': 'spatial',
+    'Area': 'spatial',
+    'Overlap': 'spatial',
+    'DetectionStore': 'columnar',
+    'load_search_index': 'search',
+    'parse_query': 'search',
+    'EmbeddingIndex': 'embeddings',
+    'Renderer': 'render',
+    'renderer_from_config': 'render'
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
@@ -0,0 +1,327 @@
+import ast
+import time
+from pathlib import Path
+import cv2
+import numpy as np
+from .results import DetectionResult
+from .utils import find_images
+
+# Same class offset ultralytics uses to run per-class NMS in one pass
+MAX_WH = 7680
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': 'ORT_DISABLE_ALL',
+    'basic': 'ORT_ENABLE_BASIC',
+    'extended': 'ORT_ENABLE_EXTENDED',
+    'all': 'ORT_ENABLE_ALL'
+}
+
+
+def letterbox(image, new_shape, auto=False, stride=32, pad_value=114):
+    """Resizes keeping the aspect ratio and pads to `new_shape` (h, w), like ultralytics' LetterBox."""
+    shape = image.shape[:2]
+    r = min(new_shape[0] / shape[0], new_shape[1] / shape[1])
+    new_unpad = round(shape[1] * r), round(shape[0] * r)
+    dw, dh = new_shape[1] - new_unpad[0], new_shape[0] - new_unpad[1]
+    if auto:
+        # Smallest stride-aligned rectangle instead of the full square
+        dw, dh = np.mod(dw, stride), np.mod(dh, stride)
+    dw /= 2
+    dh /= 2
+
+    if shape[::-1] != new_unpad:
+        image = cv2.resize(image, new_unpad, interpolation=cv2.INTER_LINEAR)
+    top, bottom = round(dh - 0.1), round(dh + 0.1)
+    left, right = round(dw - 0.1), round(dw + 0.1)
+    return cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(pad_value,) * 3)
+
+
+def scale_boxes(input_shape, boxes, image_shape):
+    """Maps xyxy boxes from the letterboxed `input_shape` back to `image_shape`, clipped."""
+    gain = min(input_shape[0] / image_shape[0], input_shape[1] / image_shape[1])
+    new_h, new_w = round(image_shape[0] * gain), round(image_shape[1] * gain)
+    gain_y, gain_x = new_h / image_shape[0], new_w / image_shape[1]
+    pad_x = round((input_shape[1] - new_w) / 2 - 0.1)
+    pad_y = round((input_shape[0] - new_h) / 2 - 0.1)
+
+    boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad_x) / gain_x).clip(0, image_shape[1])
+    boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad_y) / gain_y).clip(0, image_shape[0])
+    return boxes
+
+
+def nms(boxes, scores, iou_threshold):
+    """Greedy NMS over xyxy boxes; returns kept indices, highest score first."""
+    order = np.argsort(-scores, kind='stable')
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.maximum(0.0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]))
+        h = np.maximum(0.0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]))
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def batched_nms(boxes, scores, class_ids, iou_threshold):
+    """Per-class NMS: boxes of different classes never suppress each other."""
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = class_ids.astype(boxes.dtype)[:, None] * MAX_WH
+    return nms(boxes + offsets, scores, iou_threshold)
+
+
+class UltralyticsBackend:
+    """Runs the ultralytics/PyTorch model, or anything with the same `predict` API."""
+
+    name = 'torch'
+
+    def __init__(self, model, device='cpu', imgsz=None, max_det=300, embed=False):
+        self.model = model
+        self.device = device
+        # Passed to predict only when set, so the model's defaults still apply
+        self.options = {'max_det': max_det}
+        if imgsz is not None:
+            self.options['imgsz'] = imgsz
+        self.embed = embed
+        self._features = []
+        if embed:
+            self._hook_backbone()
+
+    def _hook_backbone(self):
+        """Captures the model input and the last backbone layer's output on every forward pass."""
+        network = self.model.model
+        if not hasattr(network, 'yaml'):
+            raise ValueError("Embeddings need an ultralytics detection model")
+        layers = network.model
+        last = layers[len(network.yaml['backbone']) - 1]
+        layers[0].register_forward_pre_hook(lambda module, args: self._features.append(['input', args[0].shape]))
+        last.register_forward_hook(lambda module, args, output: self._features[-1].append(output.detach()))
+
+    def _pooled_embeddings(self, results, num_images):
+        """Attaches image and box embeddings from the forward pass(es) of the last predict call."""
+        from .embeddings import pool_features
+
+        # ultralytics may run a warm-up pass first; the last passes cover our images
+        passes = []
+        for entry in reversed(self._features):
+            if len(entry) == 3:
+                passes.insert(0, entry)
+                if sum(len(features) for _, _, features in passes) >= num_images:
+                    break
+        features = [(tuple(shape[2:]), f) for _, shape, batch in passes for f in batch.float().cpu().numpy()]
+        self._features.clear()
+        for result, (input_shape, feature_map) in zip(results, features[-num_images:]):
+            image_shape = (result.image_size[1], result.image_size[0])
+            result.embedding, result.box_embeddings = pool_features(
+                feature_map, input_shape, image_shape, result.boxes)
+
+    def predict(self, images, image_paths, conf):
+        """Returns one (DetectionResult, speed in ms per stage) pair per image."""
+        self._features.clear()
+        results = self.model.predict(
+            source=images,
+            conf=conf,
+            device=self.device,
+            batch=len(images),
+            **self.options
+        )
+        detections = [DetectionResult.from_ultralytics(result, img_path)
+                      for img_path, result in zip(image_paths, results)]
+        if self.embed:
+            self._pooled_embeddings(detections, len(images))
+        return [(detection, getattr(result, 'speed', None) or {})
+                for detection, result in zip(detections, results)]
+
+    def warmup(self, imgsz=640, conf=0.25):
+        self.model.predict(
+            source=np.zeros((imgsz, imgsz, 3), dtype=np.uint8),
+            conf=conf,
+            device=self.device,
+            verbose=False
+        )
+
+
+def _is_fresh(target, source):
+    return target.exists() and (not source.exists() or target.stat().st_mtime >= source.stat().st_mtime)
+
+
+class _CalibrationReader:
+    """Feeds letterboxed calibration images to onnxruntime's static quantizer."""
+
+    def __init__(self, input_name, image_paths, imgsz):
+        self.input_name = input_name
+        self.image_paths = list(image_paths)
+        self.imgsz = imgsz
+        self.rewind()
+
+    def rewind(self):
+        self._paths = iter(self.image_paths)
+
+    def get_next(self):
+        for img_path in self._paths:
+            image = cv2.imread(str(img_path))
+            if image is None:
+                continue
+            batch = letterbox(image, (self.imgsz, self.imgsz))[None, ..., ::-1].transpose(0, 3, 1, 2)
+            return {self.input_name: np.ascontiguousarray(batch, dtype=np.float32) / 255.0}
+        return None
+
+
+def _head_decode_nodes(onnx_path):
+    """Non-conv nodes of the detection head (box decoding, sigmoid, concat).
+
+    The head's output puts pixel coordinates and 0-1 scores in one tensor;
+    a single uint8 scale for both rounds every score to zero, so these stay
+    in float32. The head is the module that produces the graph output.
+    """
+    import onnx
+
+    graph = onnx.load(str(onnx_path)).graph
+    outputs = {output.name for output in graph.output}
+    last = next(node for node in reversed(graph.node) if outputs.intersection(node.output))
+    head = '/'.join(last.name.split('/')[:2]) + '/'
+    return [node.name for node in graph.node
+            if node.name.startswith(head) and (node.op_type != 'Conv' or '/dfl/' in node.name)]
+
+
+def export_onnx(model_path, imgsz=640, quantize=None, calibration_images=None, image_extensions=None):
+    """Exports `model_path` to ONNX once and caches it next to the weights.
+
+    The cached file is `<weights stem>_<imgsz>.onnx` and is re-exported
+    when the weights are newer than it. With `quantize='int8'` the export
+    is also statically quantized (QDQ, int8 weights and uint8 activations)
+    to `<weights stem>_<imgsz>_int8.onnx`, with activation ranges taken
+    from `calibration_images`; delete that file to recalibrate.
+    `calibration_images` is a list of paths or a directory, which is only
+    scanned (for up to 100 `image_extensions` files) when calibrating.
+    """
+    weights = Path(model_path)
+    target = weights.with_name(f"{weights.stem}_{imgsz}.onnx")
+    if not _is_fresh(target, weights):
+        from ultralytics import YOLO
+        # Dynamic axes so batches and non-square inputs work, as with the .pt model
+        exported = YOLO(str(model_path)).export(format='onnx', imgsz=imgsz, dynamic=True)
+        Path(exported).replace(target)
+
+    if not quantize:
+        return target
+    if quantize != 'int8':
+        raise ValueError(f"Unsupported quantization: {quantize}")
+
+    quantized = target.with_name(f"{target.stem}_int8.onnx")
+    if not _is_fresh(quantized, target):
+        if calibration_images is not None and not isinstance(calibration_images, (list, tuple)):
+            directory = Path(calibration_images)
+            if not directory.is_dir():
+                raise ValueError(f"Calibration image directory not found: {directory}")
+            calibration_images = find_images(directory, image_extensions or ['.jpg', '.jpeg', '.png'])[:100]
+        if not calibration_images:
+            raise ValueError("INT8 quantization needs calibration images")
+        import onnxruntime as ort
+        from onnxruntime.quantization import quantize_static, QuantFormat, QuantType
+
+        input_name = ort.InferenceSession(str(target), providers=['CPUExecutionProvider']).get_inputs()[0].name
+        # Static rather than dynamic: dynamic quantization turns every conv into
+        # a ConvInteger that is slower than the float32 conv it replaces
+        quantize_static(
+            str(target), str(quantized),
+            _CalibrationReader(input_name, calibration_images, imgsz),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            nodes_to_exclude=_head_decode_nodes(target)
+        )
+    return quantized
+
+
+class OnnxBackend:
+    """ONNX Runtime CPU engine for an ultralytics-exported detection model.
+
+    Pre- and post-processing mirror ultralytics' predictor (letterbox,
+    best-class confidence, per-class NMS, box rescaling) so the metadata
+    matches the PyTorch backend.
+    """
+
+    name = 'onnx'
+
+    def __init__(self, onnx_path, intra_op_threads=0, inter_op_threads=0, graph_optimization='all',
+                 iou=0.7, max_det=300):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = int(intra_op_threads)
+        options.inter_op_num_threads = int(inter_op_threads)
+        options.graph_optimization_level = getattr(
+            ort.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[graph_optimization])
+        self.session = ort.InferenceSession(str(onnx_path), options, providers=['CPUExecutionProvider'])
+        self.onnx_path = str(onnx_path)
+        self.input_name = self.session.get_inputs()[0].name
+        self.iou = iou
+        self.max_det = max_det
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata['names']) if 'names' in metadata else {}
+        imgsz = ast.literal_eval(metadata.get('imgsz', '[640, 640]'))
+        self.imgsz = tuple(imgsz) if isinstance(imgsz, (list, tuple)) else (imgsz, imgsz)
+        self.stride = int(metadata.get('stride', 32))
+        # A static graph only accepts exactly imgsz
+        self.dynamic = any(not isinstance(dim, int) for dim in self.session.get_inputs()[0].shape[2:])
+
+    @classmethod
+    def from_weights(cls, model_path, imgsz=640, quantize=None, calibration_images=None, image_extensions=None,
+                     **options):
+        return cls(export_onnx(model_path, imgsz, quantize, calibration_images, image_extensions), **options)
+
+    def preprocess(self, images):
+        """Letterboxes a batch into one float32 NCHW RGB tensor."""
+        same_shapes = len({image.shape for image in images}) == 1
+        batch = [letterbox(image, self.imgsz, auto=same_shapes and self.dynamic, stride=self.stride)
+                 for image in images]
+        batch = np.stack(batch)[..., ::-1].transpose(0, 3, 1, 2)
+        return np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+
+    def postprocess(self, output, input_shape, image_shape, conf):
+        """Turns one image's raw (4 + classes, anchors) output into xyxy, conf, class arrays."""
+        pred = output.T
+        scores = pred[:, 4:]
+        class_ids = scores.argmax(1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+        keep = confidences > conf
+        pred, class_ids, confidences = pred[keep], class_ids[keep], confidences[keep]
+
+        xy, wh = pred[:, :2], pred[:, 2:4] / 2
+        boxes = np.concatenate([xy - wh, xy + wh], axis=1)
+        keep = batched_nms(boxes, confidences, class_ids, self.iou)[:self.max_det]
+        boxes = scale_boxes(input_shape, boxes[keep], image_shape)
+        return boxes.astype(np.float32), confidences[keep].astype(np.float32), class_ids[keep].astype(np.int32)
+
+    def predict(self, images, image_paths, conf):
+        """Returns one (DetectionResult, speed in ms per stage) pair per image."""
+        n = len(images)
+        start = time.perf_counter()
+        batch = self.preprocess(images)
+        preprocessed = time.perf_counter()
+        outputs = self.session.run(None, {self.input_name: batch})[0]
+        inferred = time.perf_counter()
+
+        results = []
+        for image, img_path, output in zip(images, image_paths, outputs):
+            boxes, confidences, class_ids = self.postprocess(output, batch.shape[2:], image.shape[:2], conf)
+            results.append(DetectionResult(
+                img_path, class_ids, confidences, boxes, self.names, (image.shape[1], image.shape[0])))
+        done = time.perf_counter()
+
+        speed = {
+            'preprocess': (preprocessed - start) * 1000 / n,
+            'inference': (inferred - preprocessed) * 1000 / n,
+            'postprocess': (done - inferred) * 1000 / n
+        }
+        return [(result, speed) for result in results]
+
+    def warmup(self, imgsz=640, conf=0.25):
+        self.predict([np.zeros((imgsz, imgsz, 3), dtype=np.uint8)], ['warmup'], conf)
@@ -0,0 +1,164 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+def cache_key(content_hash, model_id, conf_threshold):
+    """Key of one detection result: image content + model identity + threshold."""
+    raw = f"{content_hash}|{model_id}|{float(conf_threshold)!r}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Two-tier cache of detection results.
+
+    The memory tier is an LRU bounded by `max_items`. The optional disk tier
+    is a SQLite file at `disk_path`, evicted least-recently-used first once
+    it grows past `max_disk_bytes`. Its size is kept in the file itself, so
+    processes sharing it enforce one bound together. Values are stored as
+    JSON so callers always get a fresh copy they are free to modify.
+    """
+
+    def __init__(self, max_items=1024, disk_path=None, max_disk_bytes=1 << 30):
+        self.max_items = max(0, int(max_items))
+        self.max_disk_bytes = int(max_disk_bytes)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        if disk_path is not None:
+            disk_path = Path(disk_path)
+            disk_path.parent.mkdir(parents=True, exist_ok=True)
+            # Parallel indexer workers share the file; wait for each other's writes instead of failing
+            self._db = sqlite3.connect(str(disk_path), timeout=30, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                'size INTEGER NOT NULL, accessed REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+            # Total size of `results`, updated in the same transaction as every write; files
+            # from before this table existed are summed once
+            self._db.execute('CREATE TABLE IF NOT EXISTS usage (id INTEGER PRIMARY KEY CHECK (id = 0), '
+                             'bytes INTEGER NOT NULL)')
+            self._db.execute('INSERT OR IGNORE INTO usage (id, bytes) '
+                             'SELECT 0, COALESCE(SUM(size), 0) FROM results')
+            self._db.commit()
+
+    def get(self, key):
+        """Returns the cached result for `key`, or None."""
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return json.loads(value)
+
+            if self._db is not None:
+                row = self._db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    value = row[0]
+                    self._db.execute('UPDATE results SET accessed = ? WHERE key = ?', (time.time(), key))
+                    self._db.commit()
+                    self._remember(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return json.loads(value)
+
+            self.misses += 1
+            return None
+
+    def put(self, key, result):
+        value = json.dumps(result).encode('utf-8')
+        with self._lock:
+            self._remember(key, value)
+            if self._db is None:
+                return
+            # Take the write lock up front so other processes cannot change the size in between
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                old = self._db.execute('SELECT size FROM results WHERE key = ?', (key,)).fetchone()
+                self._db.execute(
+                    'INSERT OR REPLACE INTO results (key, value, size, accessed) VALUES (?, ?, ?, ?)',
+                    (key, value, len(value), time.time())
+                )
+                self._db.execute('UPDATE usage SET bytes = bytes + ? WHERE id = 0',
+                                 (len(value) - (old[0] if old else 0),))
+                self._evict_disk()
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+
+    def _remember(self, key, value):
+        if self.max_items == 0:
+            return
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _disk_bytes(self):
+        return self._db.execute('SELECT bytes FROM usage WHERE id = 0').fetchone()[0]
+
+    def _evict_disk(self):
+        """Deletes least recently accessed rows until the shared size fits; runs inside the write transaction."""
+        disk_bytes = self._disk_bytes()
+        while disk_bytes > self.max_disk_bytes:
+            rows = self._db.execute(
+                'SELECT key, size FROM results ORDER BY accessed LIMIT 64'
+            ).fetchall()
+            if not rows:
+                disk_bytes = 0
+                break
+            for key, size in rows:
+                self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+                disk_bytes -= size
+                if disk_bytes <= self.max_disk_bytes:
+                    break
+        self._db.execute('UPDATE usage SET bytes = ? WHERE id = 0', (disk_bytes,))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        with self._lock:
+            disk_bytes = self._disk_bytes() if self._db is not None else 0
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'memory_items': len(self._memory),
+            'disk_bytes': disk_bytes
+        }
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM results')
+                self._db.execute('UPDATE usage SET bytes = 0 WHERE id = 0')
+                self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def cache_from_config(config):
+    """Builds a ResultCache from the `cache` section of default.yaml, or None if disabled."""
+    cache_config = config.get('cache') or {}
+    if not cache_config.get('enabled', False):
+        return None
+    return ResultCache(
+        max_items=cache_config.get('max_items', 1024),
+        disk_path=cache_config.get('disk_path'),
+        max_disk_bytes=int(cache_config.get('max_disk_mb', 1024)) * 1024 * 1024
+    )
@@ -0,0 +1,162 @@
+import json
+from array import array
+from pathlib import Path
+import numpy as np
+
+COLUMNAR_SUFFIX = '.cols'
+_COLUMNS = ('image_id', 'class_id', 'confidence', 'bbox', 'offsets')
+# Per-image columns added later; stores written before them still open
+_OPTIONAL_COLUMNS = ('image_size', 'frame_index', 'timestamp')
+# Frame records are named `<video path>#frame=<index>`, see video.py
+_FRAME_SEPARATOR = '#frame='
+
+
+class DetectionStore:
+    """Columnar detection storage: one row per detection, in image order.
+
+    `image_id`, `class_id`, `confidence` and the float32 `bbox` matrix are
+    NumPy arrays. Image `i` owns rows `offsets[i]:offsets[i + 1]`, and names
+    and paths live in the `class_names` and `image_paths` tables. Indexing
+    or iterating the store gives the same dicts `process_image` returns.
+    `image_size` holds each image's (width, height), 0 where unknown.
+    Video frames also have a `frame_index` and `timestamp` (-1 and NaN for
+    still images).
+    """
+
+    def __init__(self, image_id, class_id, confidence, bbox, offsets, class_names, image_paths,
+                 image_size=None, frame_index=None, timestamp=None):
+        self.image_id = image_id
+        self.class_id = class_id
+        self.confidence = confidence
+        self.bbox = bbox
+        self.offsets = offsets
+        self.class_names = list(class_names)
+        self.image_paths = list(image_paths)
+        if image_size is None:
+            image_size = np.zeros((len(self.image_paths), 2), dtype=np.int32)
+        self.image_size = image_size
+        if frame_index is None:
+            frame_index = np.full(len(self.image_paths), -1, dtype=np.int64)
+        self.frame_index = frame_index
+        if timestamp is None:
+            timestamp = np.full(len(self.image_paths), np.nan, dtype=np.float64)
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        """Builds a store from an iterable of metadata dicts."""
+        image_id = array('i')
+        class_id = array('h')
+        confidence = array('f')
+        bbox = array('f')
+        offsets = array('q', [0])
+        image_size = array('i')
+        frame_index = array('q')
+        timestamp = array('d')
+        class_ids = {}
+        image_paths = []
+
+        for item in metadata:
+            i = len(image_paths)
+            image_paths.append(item['image_path'])
+            image_size.extend(item.get('image_size') or (0, 0))
+            frame_index.append(item.get('frame_index', -1))
+            timestamp.append(item.get('timestamp', np.nan))
+            for det in item.get('detections', []):
+                image_id.append(i)
+                class_id.append(class_ids.setdefault(det['class'], len(class_ids)))
+                confidence.append(det['confidence'])
+                bbox.extend(det['bbox'])
+            offsets.append(len(image_id))
+
+        return cls(
+            np.frombuffer(image_id, dtype=np.int32),
+            np.frombuffer(class_id, dtype=np.int16),
+            np.frombuffer(confidence, dtype=np.float32),
+            np.frombuffer(bbox, dtype=np.float32).reshape(-1, 4),
+            np.frombuffer(offsets, dtype=np.int64),
+            list(class_ids),
+            image_paths,
+            np.frombuffer(image_size, dtype=np.int32).reshape(-1, 2),
+            np.frombuffer(frame_index, dtype=np.int64),
+            np.frombuffer(timestamp, dtype=np.float64)
+        )
+
+    def save(self, path):
+        """Writes one `.npy` file per column plus `tables.json` into directory `path`."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in _COLUMNS + _OPTIONAL_COLUMNS:
+            np.save(path / f"{name}.npy", np.ascontiguousarray(getattr(self, name)))
+        with open(path / 'tables.json', 'w') as f:
+            json.dump({'class_names': self.class_names, 'image_paths': self.image_paths}, f)
+        return path
+
+    @classmethod
+    def open(cls, path, mmap_mode='r'):
+        """Opens a saved store; with `mmap_mode` the columns are memory-mapped, not read."""
+        path = Path(path)
+        if not (path / 'tables.json').exists():
+            raise FileNotFoundError(f"Detection store not found at {path}")
+        with open(path / 'tables.json', 'r') as f:
+            tables = json.load(f)
+        columns = {name: np.load(path / f"{name}.npy", mmap_mode=mmap_mode) for name in _COLUMNS}
+        for name in _OPTIONAL_COLUMNS:
+            if (path / f"{name}.npy").exists():
+                columns[name] = np.load(path / f"{name}.npy", mmap_mode=mmap_mode)
+        return cls(class_names=tables['class_names'], image_paths=tables['image_paths'], **columns)
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('image index out of range')
+
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        names = [self.class_names[c] for c in self.class_id[start:end].tolist()]
+        class_counts = {}
+        for name in names:
+            class_counts[name] = class_counts.get(name, 0) + 1
+
+        detections = [
+            {
+                'class': name,
+                'confidence': conf,
+                'bbox': bbox,
+                'count': class_counts[name]
+            }
+            for name, conf, bbox in zip(
+                names,
+                self.confidence[start:end].tolist(),
+                self.bbox[start:end].tolist()
+            )
+        ]
+        metadata = {
+            'image_path': self.image_paths[i],
+            'detections': detections,
+            'total_objects': len(detections),
+            'unique_class': list(class_counts.keys()),
+            'class_counts': class_counts
+        }
+        width, height = self.image_size[i].tolist()
+        if width and height:
+            metadata['image_size'] = [width, height]
+        frame = int(self.frame_index[i])
+        if frame >= 0:
+            metadata['video_path'] = self.image_paths[i].rsplit(_FRAME_SEPARATOR, 1)[0]
+            metadata['frame_index'] = frame
+            metadata['timestamp'] = float(self.timestamp[i])
+        return metadata
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in _COLUMNS + _OPTIONAL_COLUMNS)
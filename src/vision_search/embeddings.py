@@ -0,0 +1,459 @@
+import numpy as np
+from pathlib import Path
+
+
+def normalize(vectors):
+    """L2-normalizes rows, so inner product is cosine similarity."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def pool_features(features, input_shape, image_shape, boxes):
+    """Image and per-box embeddings from one image's backbone feature map.
+
+    `features` is (C, h, w) for the letterboxed `input_shape` (h, w) the
+    model saw; `boxes` are xyxy in the original `image_shape` (h, w). The
+    image vector averages the non-padding cells, each box vector the cells
+    under the box (at least one). Both are L2-normalized.
+    """
+    channels, fh, fw = features.shape
+    stride_y, stride_x = input_shape[0] / fh, input_shape[1] / fw
+    # Same letterbox geometry as backends.scale_boxes, in the forward direction
+    gain = min(input_shape[0] / image_shape[0], input_shape[1] / image_shape[1])
+    pad_x = round((input_shape[1] - round(image_shape[1] * gain)) / 2 - 0.1)
+    pad_y = round((input_shape[0] - round(image_shape[0] * gain)) / 2 - 0.1)
+
+    # Integral image: any rectangle's sum is four lookups
+    integral = np.zeros((fh + 1, fw + 1, channels), dtype=np.float64)
+    integral[1:, 1:] = features.transpose(1, 2, 0).cumsum(0).cumsum(1)
+
+    regions = np.vstack([
+        [[0, 0, image_shape[1], image_shape[0]]],
+        np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    ])
+    x1 = np.floor((regions[:, 0] * gain + pad_x) / stride_x)
+    y1 = np.floor((regions[:, 1] * gain + pad_y) / stride_y)
+    x2 = np.ceil((regions[:, 2] * gain + pad_x) / stride_x)
+    y2 = np.ceil((regions[:, 3] * gain + pad_y) / stride_y)
+    x1 = np.clip(x1, 0, fw - 1).astype(np.int64)
+    y1 = np.clip(y1, 0, fh - 1).astype(np.int64)
+    x2 = np.clip(np.maximum(x2, x1 + 1), 1, fw).astype(np.int64)
+    y2 = np.clip(np.maximum(y2, y1 + 1), 1, fh).astype(np.int64)
+
+    sums = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+    pooled = normalize(sums / ((x2 - x1) * (y2 - y1))[:, None])
+    return pooled[0], pooled[1:]
+
+
+def kmeans(vectors, k, iterations=20, seed=0, chunk=65536):
+    """Lloyd's k-means on float32 rows; returns (k, dim) centroids."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _nearest(vectors, centroids, chunk)
+        order = np.argsort(assign, kind='stable')
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        # Per-cluster sums over the rows sorted by cluster
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[~empty]
+        centroids[~empty] = np.add.reduceat(vectors[order], starts, axis=0) / counts[~empty, None]
+        # Restart empty clusters on random points
+        if empty.any():
+            centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+    return centroids
+
+
+def _nearest(vectors, centroids, chunk=65536):
+    """Index of the nearest centroid (squared L2) for every row."""
+    c_norms = (centroids ** 2).sum(1)
+    out = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk):
+        block = vectors[start:start + chunk]
+        out[start:start + chunk] = (c_norms - 2 * block @ centroids.T).argmin(1)
+    return out
+
+
+class _Buffer:
+    """Append-only array that grows by doubling, so adds are amortized O(1)."""
+
+    __slots__ = ('data', 'size')
+
+    def __init__(self, tail=(), dtype=np.float32, capacity=16):
+        self.data = np.empty((capacity,) + tuple(tail), dtype=dtype)
+        self.size = 0
+
+    def extend(self, rows):
+        end = self.size + len(rows)
+        if end > len(self.data):
+            grown = np.empty((max(end, 2 * len(self.data)),) + self.data.shape[1:], dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:end] = rows
+        self.size = end
+
+    @property
+    def view(self):
+        return self.data[:self.size]
+
+
+class VectorIndex:
+    """Inverted-file (IVF) index for inner-product search on normalized vectors.
+
+    Until `train_size` vectors have been added, search is exact over a flat
+    buffer. Then `nlist` k-means centroids are trained, every vector goes
+    to the list of its nearest centroid, and a query only scans the
+    `nprobe` closest lists. Vectors are stored as `dtype` (float16 halves
+    memory), or with `pq_m` as `pq_m` one-byte product-quantization codes of
+    their residual to the list centroid. Ids are assigned in add order.
+    """
+
+    def __init__(self, dim, nlist=256, nprobe=8, dtype='float16', pq_m=None, train_size=None, seed=0):
+        if pq_m is not None and dim % pq_m:
+            raise ValueError(f"pq_m={pq_m} must divide the dimension {dim}")
+        self.dim = int(dim)
+        self.nlist = int(nlist)
+        self.nprobe = int(nprobe)
+        self.dtype = np.dtype(dtype)
+        self.pq_m = pq_m
+        self.train_size = int(train_size or 40 * max(self.nlist, 256 if pq_m else 0))
+        self.seed = seed
+        self.count = 0
+        self.centroids = None
+        self.codebooks = None
+        self._flat = _Buffer((self.dim,), self.dtype)
+        self._lists = []
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def __len__(self):
+        return self.count
+
+    def add(self, vectors):
+        """Adds rows of `vectors` (normalized first); returns their ids."""
+        vectors = normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        ids = np.arange(self.count, self.count + len(vectors), dtype=np.int64)
+        self.count += len(vectors)
+        if self.is_trained:
+            self._add_to_lists(vectors, ids)
+        else:
+            self._flat.extend(vectors.astype(self.dtype))
+            if self._flat.size >= self.train_size:
+                self.train()
+        return ids
+
+    def train(self, sample=None):
+        """Trains the coarse centroids (and PQ codebooks) and moves the flat vectors into lists."""
+        flat = self._flat.view.astype(np.float32)
+        if sample is None:
+            # A bulk add can overshoot train_size; k-means on a subsample is enough
+            sample = flat
+            if len(flat) > self.train_size:
+                rng = np.random.default_rng(self.seed)
+                sample = flat[rng.choice(len(flat), self.train_size, replace=False)]
+        else:
+            sample = normalize(sample)
+        self.centroids = kmeans(sample, self.nlist, seed=self.seed)
+        self.nlist = len(self.centroids)
+        if self.pq_m:
+            residuals = sample - self.centroids[_nearest(sample, self.centroids)]
+            sub = self.dim // self.pq_m
+            self.codebooks = np.stack([
+                kmeans(residuals[:, j * sub:(j + 1) * sub], 256, seed=self.seed + j)
+                for j in range(self.pq_m)
+            ])
+        row_width = self.pq_m if self.pq_m else self.dim
+        row_dtype = np.uint8 if self.pq_m else self.dtype
+        self._lists = [(_Buffer((), np.int64), _Buffer((row_width,), row_dtype)) for _ in range(self.nlist)]
+        self._add_to_lists(flat, np.arange(len(flat), dtype=np.int64))
+        self._flat = _Buffer((self.dim,), self.dtype)
+
+    def _encode(self, residuals):
+        sub = self.dim // self.pq_m
+        codes = np.empty((len(residuals), self.pq_m), dtype=np.uint8)
+        for j in range(self.pq_m):
+            codes[:, j] = _nearest(residuals[:, j * sub:(j + 1) * sub], self.codebooks[j])
+        return codes
+
+    def _add_to_lists(self, vectors, ids):
+        assign = _nearest(vectors, self.centroids)
+        rows = self._encode(vectors - self.centroids[assign]) if self.pq_m else vectors.astype(self.dtype)
+        order = np.argsort(assign, kind='stable')
+        bounds = np.searchsorted(assign[order], np.arange(self.nlist + 1))
+        for l in np.unique(assign).tolist():
+            chunk = order[bounds[l]:bounds[l + 1]]
+            list_ids, list_rows = self._lists[l]
+            list_ids.extend(ids[chunk])
+            list_rows.extend(rows[chunk])
+
+    def _scan(self, query, l, table=None):
+        list_ids, list_rows = self._lists[l]
+        if list_ids.size == 0:
+            return None, None
+        if self.pq_m:
+            scores = query @ self.centroids[l] + table[np.arange(self.pq_m), list_rows.view].sum(1)
+        else:
+            scores = list_rows.view.astype(np.float32) @ query
+        return scores, list_ids.view
+
+    def search(self, queries, k=10, nprobe=None):
+        """Top-`k` (scores, ids) per query row, best first; missing slots have id -1."""
+        queries = normalize(np.asarray(queries, dtype=np.float32).reshape(-1, self.dim))
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        all_ids = np.full((len(queries), k), -1, dtype=np.int64)
+
+        if not self.is_trained:
+            flat = self._flat.view.astype(np.float32)
+            for q, query in enumerate(queries):
+                self._top_k(flat @ query, np.arange(len(flat)), k, all_scores[q], all_ids[q])
+            return all_scores, all_ids
+
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        coarse = queries @ self.centroids.T
+        probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+        for q, query in enumerate(queries):
+            table = None
+            if self.pq_m:
+                # Inner products of each query sub-vector with every codeword: (m, 256)
+                table = np.einsum('md,mkd->mk', query.reshape(self.pq_m, -1), self.codebooks)
+            scanned = [self._scan(query, l, table) for l in probes[q].tolist()]
+            scanned = [(s, i) for s, i in scanned if s is not None]
+            if scanned:
+                scores = np.concatenate([s for s, _ in scanned])
+                ids = np.concatenate([i for _, i in scanned])
+                self._top_k(scores, ids, k, all_scores[q], all_ids[q])
+        return all_scores, all_ids
+
+    @staticmethod
+    def _top_k(scores, ids, k, out_scores, out_ids):
+        n = min(k, len(scores))
+        if n == 0:
+            return
+        top = np.argpartition(-scores, n - 1)[:n] if n < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        out_scores[:n] = scores[top]
+        out_ids[:n] = ids[top]
+
+    def state(self, prefix):
+        """Arrays describing the index, for `np.savez`."""
+        arrays = {
+            f'{prefix}config': np.array([self.dim, self.nlist, self.nprobe, self.pq_m or 0,
+                                         self.train_size, self.seed, self.count]),
+            f'{prefix}dtype': np.array(self.dtype.str),
+            f'{prefix}flat': self._flat.view
+        }
+        if self.is_trained:
+            arrays[f'{prefix}centroids'] = self.centroids
+            if self.pq_m:
+                arrays[f'{prefix}codebooks'] = self.codebooks
+            sizes = np.array([ids.size for ids, _ in self._lists], dtype=np.int64)
+            arrays[f'{prefix}list_sizes'] = sizes
+            arrays[f'{prefix}list_ids'] = np.concatenate([ids.view for ids, _ in self._lists])
+            arrays[f'{prefix}list_rows'] = np.concatenate([rows.view for _, rows in self._lists])
+        return arrays
+
+    @classmethod
+    def from_state(cls, data, prefix):
+        dim, nlist, nprobe, pq_m, train_size, seed, count = data[f'{prefix}config'].tolist()
+        index = cls(dim, nlist, nprobe, str(data[f'{prefix}dtype']), pq_m or None, train_size, seed)
+        index.count = count
+        index._flat.extend(data[f'{prefix}flat'])
+        if f'{prefix}centroids' in data:
+            index.centroids = data[f'{prefix}centroids']
+            index.nlist = len(index.centroids)
+            if pq_m:
+                index.codebooks = data[f'{prefix}codebooks']
+            row_width = pq_m if pq_m else dim
+            row_dtype = np.uint8 if pq_m else index.dtype
+            bounds = np.concatenate([[0], np.cumsum(data[f'{prefix}list_sizes'])])
+            list_ids, list_rows = data[f'{prefix}list_ids'], data[f'{prefix}list_rows']
+            index._lists = []
+            for l in range(index.nlist):
+                ids, rows = _Buffer((), np.int64, 1), _Buffer((row_width,), row_dtype, 1)
+                ids.extend(list_ids[bounds[l]:bounds[l + 1]])
+                rows.extend(list_rows[bounds[l]:bounds[l + 1]])
+                index._lists.append((ids, rows))
+        return index
+
+
+class EmbeddingIndex:
+    """Image-level and per-detection embeddings, each in its own VectorIndex.
+
+    Filled from `DetectionResult`s that carry embeddings (see
+    `YOLOv11Inference(embeddings=...)`). Each image path is embedded once;
+    `remove` a changed or deleted file first to re-embed or drop it. Removed
+    vectors stay in the indexes but are filtered out of results. `path` is
+    where `save()` writes by default.
+    """
+
+    def __init__(self, path=None, **index_options):
+        self.path = Path(path) if path else None
+        self.index_options = index_options
+        self.image_paths = []
+        self.images = None
+        self.objects = None
+        self.class_names = []
+        self._path_ids = {}
+        # Image ids whose vectors were removed; their rows are skipped by searches
+        self._removed = set()
+        self._class_ids = {}
+        # One row per object vector
+        self._object_image = _Buffer((), np.int64)
+        self._object_class = _Buffer((), np.int32)
+        self._object_box = _Buffer((4,), np.float32)
+
+    def __len__(self):
+        return len(self._path_ids)
+
+    def __contains__(self, image_path):
+        return str(image_path) in self._path_ids
+
+    def add(self, result):
+        """Adds one DetectionResult's embeddings; returns False if the image was already indexed."""
+        if result.embedding is None:
+            raise ValueError("This result has no embeddings; enable them on the inferencer")
+        image_path = str(result.image_path)
+        if image_path in self._path_ids:
+            return False
+
+        if self.images is None:
+            dim = len(result.embedding)
+            self.images = VectorIndex(dim, **self.index_options)
+            self.objects = VectorIndex(dim, **self.index_options)
+        image_id = len(self.image_paths)
+        self._path_ids[image_path] = image_id
+        self.image_paths.append(image_path)
+        self.images.add(result.embedding[None])
+
+        if len(result):
+            self.objects.add(result.box_embeddings)
+            classes = [self._class_ids.setdefault(result.names[int(c)], len(self._class_ids))
+                       for c in result.class_ids.tolist()]
+            self.class_names = list(self._class_ids)
+            self._object_image.extend(np.full(len(result), image_id, dtype=np.int64))
+            self._object_class.extend(np.asarray(classes, dtype=np.int32))
+            self._object_box.extend(result.boxes)
+        return True
+
+    def remove(self, image_path):
+        """Drops an image and its detections from search results; returns False if it was not indexed."""
+        image_id = self._path_ids.pop(str(image_path), None)
+        if image_id is None:
+            return False
+        self._removed.add(image_id)
+        return True
+
+    def _search(self, index, vector, k, nprobe, keep, fetch=None):
+        """Top-`k` (score, row) hits of `index` for which `keep(rows)` is True, best first.
+
+        Fetches `fetch` rows (default `k`), widening until `k` hits are found
+        or every row is scanned.
+        """
+        fetch = fetch or k
+        while True:
+            scores, ids = index.search(vector, fetch, nprobe)
+            scores, ids = scores[0], ids[0]
+            hit = ids >= 0
+            hit[hit] = keep(ids[hit])
+            if hit.sum() >= k or fetch >= len(index):
+                return list(zip(scores[hit].tolist(), ids[hit].tolist()))[:k]
+            fetch *= 4
+
+    def search_images(self, vector, k=10, nprobe=None):
+        """Images most similar to an image embedding: [{'image_path', 'score'}], best first."""
+        if self.images is None:
+            return []
+        removed = np.fromiter(self._removed, dtype=np.int64)
+        hits = self._search(self.images, vector, k, nprobe, lambda ids: ~np.isin(ids, removed))
+        return [{'image_path': self.image_paths[i], 'score': s} for s, i in hits]
+
+    def search_objects(self, vector, k=10, cls=None, nprobe=None):
+        """Detections most similar to a box embedding, optionally of class `cls`, best first.
+
+        Returns [{'image_path', 'class', 'bbox', 'score'}].
+        """
+        if self.objects is None or len(self.objects) == 0:
+            return []
+        wanted = self._class_ids.get(cls) if cls is not None else None
+        if cls is not None and wanted is None:
+            return []
+
+        removed = np.fromiter(self._removed, dtype=np.int64)
+
+        def keep(ids):
+            live = ~np.isin(self._object_image.view[ids], removed)
+            return live if wanted is None else live & (self._object_class.view[ids] == wanted)
+
+        # Over-fetch when filtering by class
+        hits = self._search(self.objects, vector, k, nprobe, keep, fetch=k if cls is None else 4 * k)
+        return [
+            {
+                'image_path': self.image_paths[self._object_image.view[i]],
+                'class': self.class_names[self._object_class.view[i]],
+                'bbox': self._object_box.view[i].tolist(),
+                'score': s
+            }
+            for s, i in hits
+        ]
+
+    def save(self, path=None):
+        """Saves the embeddings and both indexes to a `.npz` file (`self.path` by default)."""
+        path = Path(path or self.path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        arrays = {
+            'image_paths': np.array(self.image_paths, dtype=str),
+            'class_names': np.array(self.class_names, dtype=str),
+            'object_image': self._object_image.view,
+            'object_class': self._object_class.view,
+            'object_box': self._object_box.view,
+            'removed': np.array(sorted(self._removed), dtype=np.int64)
+        }
+        if self.images is not None:
+            arrays.update(self.images.state('images_'))
+            arrays.update(self.objects.state('objects_'))
+        np.savez(path, **arrays)
+        return path
+
+    @classmethod
+    def load(cls, path, **index_options):
+        """Loads an index written by `save`; `index_options` apply only if it is still empty."""
+        path = Path(path)
+        if not path.exists():
+            raise FileNotFoundError(f"Embedding index not found at {path}")
+        index = cls(path, **index_options)
+        with np.load(path) as data:
+            index.image_paths = data['image_paths'].tolist()
+            if 'removed' in data:
+                index._removed = set(data['removed'].tolist())
+            # A re-embedded path appears again later, under a new id
+            index._path_ids = {p: i for i, p in enumerate(index.image_paths) if i not in index._removed}
+            index.class_names = data['class_names'].tolist()
+            index._class_ids = {name: c for c, name in enumerate(index.class_names)}
+            index._object_image.extend(data['object_image'])
+            index._object_class.extend(data['object_class'])
+            index._object_box.extend(data['object_box'])
+            if 'images_config' in data:
+                index.images = VectorIndex.from_state(data, 'images_')
+                index.objects = VectorIndex.from_state(data, 'objects_')
+        return index
+
+
+def embeddings_from_config(config):
+    """An EmbeddingIndex from the `embeddings` section of default.yaml (loaded if saved), or None."""
+    embed_config = config.get('embeddings') or {}
+    if not embed_config.get('enabled', False):
+        return None
+    options = {
+        'nlist': embed_config.get('nlist', 256),
+        'nprobe': embed_config.get('nprobe', 8),
+        'dtype': embed_config.get('dtype', 'float16'),
+        'pq_m': embed_config.get('pq_m')
+    }
+    path = embed_config.get('path')
+    if path and Path(path).exists():
+        return EmbeddingIndex.load(path, **options)
+    return EmbeddingIndex(path, **options)
@@ -0,0 +1,249 @@
+import numpy as np
+from pathlib import Path
+
+
+class Term:
+    """Matches images containing `cls` between `min_count` and `max_count` times.
+
+    With `min_confidence`, only detections at or above it are counted.
+    Terms combine with `&` (AND), `|` (OR) and `~` (NOT).
+    """
+
+    def __init__(self, cls, min_count=1, max_count=None, min_confidence=None):
+        self.cls = cls
+        self.min_count = min_count
+        self.max_count = max_count
+        self.min_confidence = min_confidence
+
+    def evaluate(self, index):
+        return index._term_ids(self)
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def __repr__(self):
+        return (f"Term({self.cls!r}, min_count={self.min_count}, "
+                f"max_count={self.max_count}, min_confidence={self.min_confidence})")
+
+
+class And(Term):
+    def __init__(self, *queries):
+        self.queries = queries
+
+    def evaluate(self, index):
+        # Start from the smallest posting so every intersection stays small
+        results = sorted((q.evaluate(index) for q in self.queries), key=len)
+        ids = results[0]
+        for other in results[1:]:
+            if len(ids) == 0:
+                break
+            ids = np.intersect1d(ids, other, assume_unique=True)
+        return ids
+
+    def __repr__(self):
+        return f"And{self.queries!r}"
+
+
+class Or(Term):
+    def __init__(self, *queries):
+        self.queries = queries
+
+    def evaluate(self, index):
+        ids = np.empty(0, dtype=np.int64)
+        for query in self.queries:
+            ids = np.union1d(ids, query.evaluate(index))
+        return ids
+
+    def __repr__(self):
+        return f"Or{self.queries!r}"
+
+
+class Not(Term):
+    def __init__(self, query):
+        self.query = query
+
+    def evaluate(self, index):
+        return np.setdiff1d(index.all_ids(), self.query.evaluate(index), assume_unique=True)
+
+    def __repr__(self):
+        return f"Not({self.query!r})"
+
+
+class _Posting:
+    """Images containing one class.
+
+    `ids`/`counts` are ordered by count so a count range is a binary search.
+    `det_ids`/`det_conf` hold one row per detection, ordered by image id.
+    """
+
+    __slots__ = ('ids', 'counts', 'det_ids', 'det_conf')
+
+    def __init__(self, ids, counts, det_ids, det_conf):
+        order = np.argsort(counts, kind='stable')
+        self.ids = ids[order]
+        self.counts = counts[order]
+        self.det_ids = det_ids
+        self.det_conf = det_conf
+
+
+class MetadataIndex:
+    """Inverted class -> image index over the metadata `process_directory` produces.
+
+    `spatial` is an optional `spatial.SpatialIndex` over the same images,
+    which lets `Region`/`Area`/`Overlap` predicates mix with class terms.
+    """
+
+    def __init__(self, image_paths, postings, spatial=None):
+        self.image_paths = list(image_paths)
+        self.postings = postings
+        self.spatial = spatial
+
+    @classmethod
+    def build(cls, metadata, spatial=False, grid_size=16):
+        """Builds the index from an iterable of metadata dicts or a `DetectionStore`.
+
+        With `spatial`, a grid index over the boxes is built and attached too.
+        """
+        if spatial:
+            from .spatial import SpatialIndex
+            if not hasattr(metadata, 'class_id'):
+                metadata = list(metadata)
+            index = cls.build(metadata)
+            index.spatial = SpatialIndex.build(metadata, grid_size=grid_size)
+            return index
+        if hasattr(metadata, 'class_id'):
+            return cls.from_store(metadata)
+
+        image_paths = []
+        det_ids = {}
+        det_conf = {}
+
+        for image_id, item in enumerate(metadata):
+            image_paths.append(item['image_path'])
+            for det in item.get('detections', []):
+                det_ids.setdefault(det['class'], []).append(image_id)
+                det_conf.setdefault(det['class'], []).append(det['confidence'])
+
+        postings = {}
+        for name in det_ids:
+            ids = np.asarray(det_ids[name], dtype=np.int64)
+            conf = np.asarray(det_conf[name], dtype=np.float32)
+            unique_ids, counts = np.unique(ids, return_counts=True)
+            postings[name] = _Posting(unique_ids, counts, ids, conf)
+
+        return cls(image_paths, postings)
+
+    @classmethod
+    def from_store(cls, store):
+        """Builds the index straight from the columns of a `DetectionStore`."""
+        class_id = np.asarray(store.class_id)
+        order = np.argsort(class_id, kind='stable')
+        bounds = np.searchsorted(class_id[order], np.arange(len(store.class_names) + 1))
+
+        postings = {}
+        for c, name in enumerate(store.class_names):
+            rows = order[bounds[c]:bounds[c + 1]]
+            if len(rows) == 0:
+                continue
+            ids = np.asarray(store.image_id[rows], dtype=np.int64)
+            conf = np.asarray(store.confidence[rows])
+            unique_ids, counts = np.unique(ids, return_counts=True)
+            postings[name] = _Posting(unique_ids, counts, ids, conf)
+
+        return cls(store.image_paths, postings)
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def all_ids(self):
+        return np.arange(len(self.image_paths), dtype=np.int64)
+
+    def _term_ids(self, term):
+        lo = term.min_count
+        hi = term.max_count
+        posting = self.postings.get(term.cls)
+
+        if posting is None:
+            ids = present = np.empty(0, dtype=np.int64)
+        elif term.min_confidence is None:
+            # Binary search the count-ordered posting
+            start = np.searchsorted(posting.counts, lo, side='left')
+            end = len(posting.counts) if hi is None else np.searchsorted(posting.counts, hi, side='right')
+            ids = np.sort(posting.ids[start:end])
+            present = posting.ids
+        else:
+            keep = posting.det_conf >= term.min_confidence
+            present, counts = np.unique(posting.det_ids[keep], return_counts=True)
+            mask = counts >= lo
+            if hi is not None:
+                mask &= counts <= hi
+            ids = present[mask]
+
+        # A range that includes zero also matches images without the class
+        if lo <= 0 and (hi is None or hi >= 0):
+            ids = np.union1d(ids, np.setdiff1d(self.all_ids(), present))
+        return ids
+
+    def search_ids(self, query):
+        """Returns the sorted image ids matching a Term/And/Or/Not query."""
+        return query.evaluate(self)
+
+    def search(self, query):
+        """Returns the image paths matching a Term/And/Or/Not query."""
+        return [self.image_paths[i] for i in self.search_ids(query)]
+
+    def unique_classes_counts(self):
+        """Same facet lists as `utils.get_unique_classes_counts`, served from the postings."""
+        unique_classes = sorted(self.postings)
+        count_options = {
+            name: np.unique(self.postings[name].counts).tolist()
+            for name in unique_classes
+        }
+        return unique_classes, count_options
+
+    def save(self, path):
+        """Saves the index to a `.npz` file, with the spatial grid if one is attached."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        classes = sorted(self.postings)
+        arrays = {
+            'image_paths': np.array(self.image_paths, dtype=str),
+            'classes': np.array(classes, dtype=str)
+        }
+        for i, name in enumerate(classes):
+            posting = self.postings[name]
+            arrays[f'ids_{i}'] = posting.ids
+            arrays[f'counts_{i}'] = posting.counts
+            arrays[f'det_ids_{i}'] = posting.det_ids
+            arrays[f'det_conf_{i}'] = posting.det_conf
+        if self.spatial is not None:
+            arrays.update(self.spatial.state('spatial_'))
+        np.savez(path, **arrays)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """Loads an index written by `save`."""
+        path = Path(path)
+        if not path.exists():
+            raise FileNotFoundError(f"Index file not found at {path}")
+        with np.load(path) as data:
+            postings = {}
+            for i, name in enumerate(data['classes'].tolist()):
+                posting = _Posting.__new__(_Posting)
+                posting.ids = data[f'ids_{i}']
+                posting.counts = data[f'counts_{i}']
+                posting.det_ids = data[f'det_ids_{i}']
+                posting.det_conf = data[f'det_conf_{i}']
+                postings[name] = posting
+            spatial = None
+            if 'spatial_boxes' in data:
+                from .spatial import SpatialIndex
+                spatial = SpatialIndex.from_state(data, 'spatial_')
+            return cls(data['image_paths'].tolist(), postings, spatial=spatial)
@@ -1,79 +1,409 @@
-from ultralytics import YOLO
 from pathlib import Path
+import hashlib
+import numpy as np
+from .utils import iter_images, file_hash, MetadataWriter
+from .cache import cache_key
+from .instrumentation import Instrumentation
+from .backends import UltralyticsBackend, OnnxBackend
+from .pipeline import decode_image, decode_reduced, iter_prefetched
+from .tiling import Tiler
 # import torch
 # from PIL import Image
-# import numpy
 
 class YOLOv11Inference:
-    def __init__(self, model_path, conf_threshold, image_extensions, device='cpu'):
-        self.model = YOLO(model_path)
+    def __init__(self, model_path, conf_threshold, image_extensions, device='cpu', batch_size=1, cache=None,
+                 metrics=None, backend='torch', backend_options=None, imgsz=None, max_det=300, quantize=None,
+                 calibration_images=None, embeddings=None, tiling=None, reduced_decode=False,
+                 prefetch_options=None, walk_options=None):
+        self.model_path = str(model_path)
+        self.imgsz = imgsz
+        self.max_det = max_det
+        # JPEGs decode at a DCT scale no smaller than the model input; boxes are scaled back
+        self.decode_size = (imgsz or 640) if reduced_decode else None
+        # Images larger than `tiling['tile_size']` are detected tile by tile
+        self.tiler = None
+        if tiling and tiling.get('tile_size'):
+            if embeddings is not None:
+                raise ValueError("Embeddings are not supported with tiled inference")
+            self.tiler = Tiler(batch_size=batch_size, **tiling)
+        # Runtime, input size and quantization all change the output, so they key the cache too
+        self.model_id = f"{self._model_identity(model_path)}|{backend}|{imgsz}|{max_det}|{quantize}"
+        if self.tiler is not None:
+            self.model_id += f"|{self.tiler.key}"
+        if self.decode_size is not None:
+            self.model_id += f"|reduced>={self.decode_size}"
+        self.cache = cache
+        # EmbeddingIndex that every detected image is added to, or None
+        self.embeddings = embeddings
+        self.metrics = metrics if metrics is not None else Instrumentation()
         self.device = device
-        self.model.to(self.device)
+        backend_options = dict(backend_options or {})
+        if backend == 'onnx':
+            if device != 'cpu':
+                raise ValueError("The onnx backend only runs on the CPU")
+            if embeddings is not None:
+                raise ValueError("Embeddings need the torch backend")
+            self.model = None
+            # A calibration directory is only scanned if the INT8 model has to be (re)built
+            self.backend = OnnxBackend.from_weights(
+                model_path, imgsz=imgsz or 640, quantize=quantize, calibration_images=calibration_images,
+                image_extensions=image_extensions, max_det=max_det, **backend_options)
+        elif backend == 'torch':
+            if quantize:
+                raise ValueError("Quantization is only supported by the onnx backend")
+            self.model = self._load_model(model_path)
+            self.model.to(self.device)
+            self.backend = UltralyticsBackend(self.model, self.device, imgsz=imgsz, max_det=max_det,
+                                              embed=embeddings is not None)
+        else:
+            raise ValueError(f"Unknown inference backend: {backend}")
         self.conf_threshold = conf_threshold
         self.extensions = image_extensions
+        self.batch_size = max(1, int(batch_size))
+        # `iter_prefetched` arguments for directory runs, or None to read and decode in line
+        self.prefetch_options = prefetch_options
+        # Default `utils.iter_images` options (recursion, include/exclude, ...) for directory runs
+        self.walk_options = dict(walk_options or {})
 
-    def process_image(self, image_path):
+    def _load_model(self, model_path):
+        # Deferred: importing ultralytics pulls in torch, which the onnx backend never needs
+        from ultralytics import YOLO
+        return YOLO(model_path)
 
-        # Run inference
-        results = self.model.predict(
-            source=image_path,
-            conf=self.conf_threshold,
-            device=self.device
-        )
+    @staticmethod
+    def _model_identity(model_path):
+        """Path plus size and mtime of the weights, so retrained weights miss the cache"""
+        path = Path(model_path)
+        if path.exists():
+            stat = path.stat()
+            return f"{path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+        return str(model_path)
 
-        # process results
-        detection = []
-        class_counts = {}
+    def warmup(self, imgsz=None):
+        """Runs one forward pass on a blank image so the first real request is not slow"""
+        self.backend.warmup(imgsz or self.imgsz or 640, conf=self.conf_threshold)
 
-        for result in results:
-            for box in result.boxes:
-                cls = result.names[int(box.cls)]
-                conf = float(box.conf)
-                bbox = box.xyxy[0].tolist()
+    def process_image(self, image, image_path=None, content_hash=None, image_size=None):
+        """Runs detection on one image, answering from the result cache when possible
 
-                detection.append({
-                    'class' : cls,
-                    'confidence' : conf,
-                    'bbox' : bbox,
-                    'count' : 1
-                })
+        `image` is a file path, or an in-memory image: encoded bytes, a PIL
+        image or a BGR NumPy array, which is used as is without a copy.
+        `image_path` labels in-memory images; `content_hash` (sha256 of the
+        encoded file) lets decoded arrays use the result cache. If the array
+        is a reduced decode, `image_size` is the full-resolution (width,
+        height) the boxes are scaled back to.
+        """
+        if isinstance(image, (str, Path)):
+            return self._run_batch([image], strict=True)[0]
 
-                class_counts[cls] = class_counts.get(cls, 0) + 1
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            content_hash = content_hash or hashlib.sha256(image).hexdigest()
+            with self.metrics.stage('decode'):
+                array, image_size = self.decode(image)
+        else:
+            with self.metrics.stage('decode'):
+                array, decoded_hash = decode_image(image)
+            content_hash = content_hash or decoded_hash
+        return self.process_arrays(
+            [array],
+            [image_path or 'memory'],
+            [content_hash] if content_hash else None,
+            strict=True,
+            image_sizes=[image_size]
+        )[0]
 
-        for det in detection:
-            det['count'] = class_counts[det['class']]
+    def decode(self, data, min_size=None):
+        """Decodes encoded bytes for the model: (BGR array, full-resolution (width, height))
 
-        return {
-            'image_path' : str(image_path),
-            'detections' : detection,
-            'total_objects' : len(detection),
-            'unique_class' : list(class_counts.keys()), # [0, 1, 2]
-            'class_counts' : class_counts # {0 : 3, 1 : 10, 2, : 1}
-        }
+        With `reduced_decode`, JPEGs decode at the smallest DCT scale that
+        still covers the model input, or `min_size` if that is larger (e.g.
+        a display size); see `pipeline.decode_reduced`. Images larger than
+        one tile always decode at full size, since the tiler needs their
+        original pixels.
+        """
+        if self.decode_size is None:
+            return decode_reduced(bytes(data))
+        max_size = self.tiler.tile_size if self.tiler is not None else None
+        return decode_reduced(bytes(data), max(min_size or 0, self.decode_size), max_size)
 
+    def read_image(self, image_path):
+        """Reads an image file for the model: (BGR array, sha256, full-resolution size, cached metadata)
 
-    def process_directory(self, directory):
-        metadata = []
-
-        patterns = [f"*{ext}" for ext in self.extensions]
+        The file is hashed before it is decoded; on a result-cache hit the
+        array and size are None and only the cached metadata is returned.
+        """
+        data = Path(image_path).read_bytes()
+        content_hash = hashlib.sha256(data).hexdigest()
+        if self.cache is not None:
+            # A miss is counted by process_arrays, which looks the key up again
+            metadata = self._cache_get(cache_key(content_hash, self.model_id, self.conf_threshold), image_path,
+                                       count_miss=False)
+            if metadata is not None:
+                return None, content_hash, None, metadata
+        image, full_size = self.decode(data)
+        return image, content_hash, full_size, None
 
-        image_paths = []
-        for pattern in patterns:
-            image_paths.extend(Path(directory).glob(pattern))
+    def _run_batch(self, batch, strict=False):
+        """Reads, decodes and detects a batch of image paths with one predict call
 
-        for img_path in image_paths:
+        Images that fail are reported and left out, unless `strict` re-raises.
+        """
+        out = [None] * len(batch)
+        todo = []
+        for i, img_path in enumerate(batch):
             try:
-                metadata.append(self.process_image(img_path))
+                if self.tiler is not None and self.tiler.wants(img_path):
+                    out[i] = self._process_tiled(img_path, img_path)
+                    continue
+                with self.metrics.stage('read'):
+                    data = Path(img_path).read_bytes()
+                key = None
+                if self.cache is not None:
+                    key = cache_key(hashlib.sha256(data).hexdigest(), self.model_id, self.conf_threshold)
+                    out[i] = self._cache_get(key, img_path)
+                    if out[i] is not None:
+                        continue
+                with self.metrics.stage('decode'):
+                    try:
+                        image, full_size = self.decode(data)
+                    except ValueError:
+                        raise ValueError(f"cannot identify image file {img_path}") from None
             except Exception as e:
-                print(f"Error processing {img_path}: {str(e)}")
+                if strict:
+                    raise
+                self._report_error(img_path, e)
+                continue
+            todo.append((i, image, key, full_size))
+
+        self._predict_pending(out, todo, batch, strict)
+        return [metadata for metadata in out if metadata is not None]
+
+    def process_batch(self, image_paths):
+        """Runs one predict call over a batch of images, one metadata dict per image"""
+        return self._run_batch(image_paths)
+
+    def process_arrays(self, images, image_paths, content_hashes=None, strict=False, image_sizes=None):
+        """Runs one predict call over already-decoded BGR arrays
+
+        `image_paths` only label the results. With `content_hashes` (sha256 of
+        the encoded files) the result cache is used as well. `image_sizes`
+        gives the full-resolution (width, height) of arrays that are reduced
+        decodes (None for the others); their boxes are scaled back to it.
+        """
+        out = [None] * len(images)
+        todo = []
+        for i, image in enumerate(images):
+            full_size = image_sizes[i] if image_sizes else None
+            if self.tiler is not None and self.tiler.wants(image if full_size is None else full_size):
+                try:
+                    out[i] = self._process_tiled(image, image_paths[i], content_hashes[i] if content_hashes else None,
+                                                 full_size)
+                except Exception as e:
+                    if strict:
+                        raise
+                    self._report_error(image_paths[i], e)
                 continue
+            key = None
+            if self.cache is not None and content_hashes is not None:
+                key = cache_key(content_hashes[i], self.model_id, self.conf_threshold)
+                out[i] = self._cache_get(key, image_paths[i])
+                if out[i] is not None:
+                    continue
+            todo.append((i, image, key, full_size))
+
+        self._predict_pending(out, todo, image_paths, strict)
+        return [metadata for metadata in out if metadata is not None]
+
+    def _process_tiled(self, image, image_path, content_hash=None, full_size=None):
+        """Detects one large image tile by tile (see `tiling.Tiler`); returns its metadata dict
+
+        `full_size` is the full-resolution (width, height) of an array that
+        is a reduced decode; its boxes are scaled back to it. Decoding such
+        images at full size (as `decode` does) gives the tiler more detail.
+        """
+        key = None
+        if self.cache is not None:
+            if content_hash is None and isinstance(image, (str, Path)):
+                with self.metrics.stage('read'):
+                    content_hash = file_hash(image)
+            if content_hash is not None:
+                key = cache_key(content_hash, self.model_id, self.conf_threshold)
+                metadata = self._cache_get(key, image_path)
+                if metadata is not None:
+                    return metadata
+
+        result = self.tiler.detect(image, image_path, self.backend, self.conf_threshold, self.metrics)
+        self._rescale(result, full_size)
+        self.metrics.incr('images')
+        self.metrics.incr('detections', len(result))
+        with self.metrics.stage('parse'):
+            metadata = result.to_dict()
+        if key is not None:
+            self.cache.put(key, metadata)
+        return metadata
+
+    def _cache_get(self, key, image_path, count_miss=True):
+        if self.embeddings is not None:
+            # Cached metadata has no vectors, so embedding runs always predict
+            return None
+        metadata = self.cache.get(key)
+        if metadata is None:
+            if count_miss:
+                self.metrics.incr('cache_misses')
+            return None
+        self.metrics.incr('cache_hits')
+        self.metrics.incr('images')
+        metadata['image_path'] = str(image_path)
+        return metadata
+
+    def _predict_pending(self, out, todo, image_paths, strict=False):
+        """Fills `out[i]` for every (i, image, cache key, full-resolution size) in `todo`"""
+        if not todo:
+            return
+        indices, images, keys, sizes = zip(*todo)
+        names = [image_paths[i] for i in indices]
+        try:
+            metadata = self._predict(list(images), names, image_sizes=sizes)
+        except Exception as e:
+            if strict:
+                raise
+            if len(images) == 1:
+                self._report_error(names[0], e)
+                return
+            # Retry image by image so one failure does not drop the batch
+            print(f"Batch of {len(images)} failed ({str(e)}), retrying one by one")
+            metadata = []
+            for image, name, size in zip(images, names, sizes):
+                try:
+                    metadata.extend(self._predict([image], [name], image_sizes=[size]))
+                except Exception as e:
+                    self._report_error(name, e)
+                    metadata.append(None)
+
+        for i, key, item in zip(indices, keys, metadata):
+            out[i] = item
+            if key is not None and item is not None:
+                self.cache.put(key, item)
+
+    def detect_arrays(self, images, image_paths):
+        """Like `process_arrays` but returns compact `DetectionResult`s and skips the cache"""
+        return self._predict(list(images), list(image_paths), compact=True)
+
+    def embed_image(self, image, image_path=None):
+        """Compact `DetectionResult` of one image with its embeddings, not added to the index
+
+        Used to build similarity queries; `image` is anything `process_image` accepts.
+        """
+        if self.embeddings is None:
+            raise ValueError("Embeddings are not enabled for this inferencer")
+        if isinstance(image, (str, Path)):
+            image_path = image_path or image
+            with self.metrics.stage('read'):
+                image = Path(image).read_bytes()
+        full_size = None
+        with self.metrics.stage('decode'):
+            if isinstance(image, (bytes, bytearray, memoryview)):
+                array, full_size = self.decode(image)
+            else:
+                array, _ = decode_image(image)
+        return self._predict([array], [image_path or 'memory'], compact=True, index=False,
+                             image_sizes=[full_size])[0]
+
+    def _predict(self, images, image_paths, compact=False, index=True, image_sizes=None):
+        """One backend predict call over decoded images"""
+        with self.metrics.stage('predict'):
+            predictions = self.backend.predict(images, image_paths, self.conf_threshold)
+        self.metrics.incr('batches')
+        if image_sizes is not None:
+            for (item, _), full_size in zip(predictions, image_sizes):
+                self._rescale(item, full_size)
+        if self.embeddings is not None and index:
+            with self.metrics.stage('embed'):
+                for item, _ in predictions:
+                    self.embeddings.add(item)
+
+        metadata = []
+        for item, speed in predictions:
+            # The backend's own per-image timings, in milliseconds
+            for stage, ms in speed.items():
+                if ms is not None:
+                    self.metrics.observe(stage, ms / 1000)
+            self.metrics.incr('images')
+            self.metrics.incr('detections', len(item))
+            if not compact:
+                with self.metrics.stage('parse'):
+                    item = item.to_dict()
+            metadata.append(item)
+        return metadata
+
+    @staticmethod
+    def _rescale(item, full_size):
+        """Maps the boxes of a reduced decode back to the full-resolution (width, height)"""
+        if full_size is None or item.image_size is None or tuple(full_size) == tuple(item.image_size):
+            return
+        scale_x = full_size[0] / item.image_size[0]
+        scale_y = full_size[1] / item.image_size[1]
+        item.boxes = item.boxes * np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+        item.image_size = (int(full_size[0]), int(full_size[1]))
+
+    def _report_error(self, image_path, error):
+        self.metrics.incr('errors')
+        print(f"Error processing {image_path}: {str(error)}")
+
+    def process_paths(self, image_paths, batch_size=None):
+        """Processes a list of image paths in batches of `batch_size`"""
+        return list(self.iter_paths(image_paths, batch_size=batch_size))
+
+    def iter_paths(self, image_paths, batch_size=None):
+        """Like `process_paths`, but yields each metadata dict as soon as its batch is done"""
+        batch_size = max(1, int(batch_size or self.batch_size))
+        batch = []
+        for img_path in image_paths:
+            batch.append(img_path)
+            if len(batch) == batch_size:
+                yield from self._run_batch(batch)
+                batch = []
+        if batch:
+            yield from self._run_batch(batch)
+
+    def iter_directory(self, directory, batch_size=None, **walk_options):
+        """Yields the metadata of every image under `directory`
+
+        `walk_options` go to `utils.iter_images`, on top of the inferencer's own.
+
+        With `prefetch_options`, a thread pool reads and decodes ahead of the
+        model (see `pipeline.iter_prefetched`). Tiled inference reads its
+        own bands, so it keeps the in-line path.
+        """
+        image_paths = iter_images(directory, self.extensions, **{**self.walk_options, **walk_options})
+        if self.prefetch_options and self.tiler is None:
+            return iter_prefetched(self, image_paths, batch_size=batch_size, **self.prefetch_options)
+        return self.iter_paths(image_paths, batch_size=batch_size)
+
+    def process_directory(self, directory, batch_size=None, **walk_options):
+        """Processes every image under `directory`; see `iter_directory`"""
+        metadata = list(self.iter_directory(directory, batch_size=batch_size, **walk_options))
         # print(metadata)
         return metadata
+
+    def index_directory(self, directory, output_path, batch_size=None, flush_every=100, **walk_options):
+        """Streams a directory's metadata to a JSON Lines file as it is produced"""
+        with MetadataWriter(output_path, flush_every=flush_every) as writer:
+            for item in self.iter_directory(directory, batch_size=batch_size, **walk_options):
+                writer.write(item)
+        self.save_embeddings()
+        return writer.output_path
+
+    def save_embeddings(self):
+        """Writes the embedding index to its configured path, if there is one"""
+        if self.embeddings is not None and self.embeddings.path is not None:
+            return self.embeddings.save()
+        return None
     
-    def process_single_image(self, image_path):
-        """Process a single image and return metadata"""
+    def process_single_image(self, image, image_path=None, content_hash=None, image_size=None):
+        """Process a single image (path or in-memory, see `process_image`) and return metadata"""
         try:
-            return self.process_image(image_path)
+            return self.process_image(image, image_path, content_hash, image_size)
         except Exception as e:
-            print(f"Error processing {image_path}: {str(e)}")
+            self._report_error(image if isinstance(image, (str, Path)) else image_path or 'memory', e)
             return None
@@ -0,0 +1,160 @@
+import io
+import time
+import pstats
+import bisect
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, num_buckets):
+        self.counts = [0] * (num_buckets + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+
+class Instrumentation:
+    """Per-stage timers, counters and latency histograms for the inference path.
+
+    Stages are recorded with `stage(name)` or `observe(name, seconds)`;
+    `last` keeps the most recent duration of every stage in milliseconds,
+    from whichever thread recorded it. `collect()` gives the timings of one
+    call in the current thread only. Export with `to_json()` or
+    `to_prometheus()`.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counters = {}
+        self.histograms = {}
+        self.last = {}
+        self._lock = threading.Lock()
+        # Per-thread dicts filled by `collect`
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    @contextmanager
+    def collect(self):
+        """Yields a dict of the stage timings (ms, summed per stage) this thread records inside the block.
+
+        Other threads and sessions sharing the instance do not show up in it,
+        so it is safe for per-request timings.
+        """
+        timings = {}
+        outer = getattr(self._local, 'timings', None)
+        self._local.timings = timings
+        try:
+            yield timings
+        finally:
+            self._local.timings = outer
+
+    def observe(self, name, seconds):
+        timings = getattr(self._local, 'timings', None)
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + seconds * 1000
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = _Histogram(len(self.buckets))
+            histogram.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram.sum += seconds
+            histogram.count += 1
+            self.last[name] = seconds * 1000
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.last.clear()
+
+    def to_json(self):
+        """Counters plus, per stage, count, total/mean milliseconds and cumulative buckets."""
+        with self._lock:
+            stages = {}
+            for name, histogram in self.histograms.items():
+                cumulative = 0
+                buckets = {}
+                for bound, count in zip(self.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    buckets['+Inf' if bound == float('inf') else f"{bound * 1000:g}ms"] = cumulative
+                stages[name] = {
+                    'count': histogram.count,
+                    'total_ms': histogram.sum * 1000,
+                    'mean_ms': histogram.sum * 1000 / histogram.count if histogram.count else 0.0,
+                    'last_ms': self.last.get(name),
+                    'buckets': buckets
+                }
+            return {'counters': dict(self.counters), 'stages': stages}
+
+    def to_prometheus(self, prefix='vision_search'):
+        """Prometheus text exposition format."""
+        with self._lock:
+            lines = []
+            for name, value in sorted(self.counters.items()):
+                metric = f"{prefix}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+
+            if self.histograms:
+                metric = f"{prefix}_stage_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for name, histogram in sorted(self.histograms.items()):
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                        lines.append(f'{metric}_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+                    lines.append(f'{metric}_sum{{stage="{name}"}} {histogram.sum:.6f}')
+                    lines.append(f'{metric}_count{{stage="{name}"}} {histogram.count}')
+            return '\n'.join(lines) + '\n'
+
+    @contextmanager
+    def profile(self, cprofile=True, memory=False, top=25):
+        """Profiles the enclosed block with cProfile and/or tracemalloc.
+
+        Yields a dict that is filled in on exit: `cprofile` holds the top
+        functions by cumulative time, `tracemalloc` the peak traced memory
+        and the top allocation sites.
+        """
+        report = {}
+        profiler = cProfile.Profile() if cprofile else None
+        started_tracing = memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield report
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                stream = io.StringIO()
+                pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(top)
+                report['cprofile'] = stream.getvalue()
+            if memory:
+                snapshot = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                report['tracemalloc'] = {
+                    'peak_bytes': peak,
+                    'top': [str(stat) for stat in snapshot.statistics('lineno')[:top]]
+                }
+                if started_tracing:
+                    tracemalloc.stop()
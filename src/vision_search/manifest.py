@@ -0,0 +1,152 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from .utils import find_images, file_hash, save_metadata, load_metadata
+
+MANIFEST_VERSION = 2
+
+
+def manifest_path_for(metadata_path):
+    """The manifest lives next to the metadata JSON: `metadata.json` -> `metadata.manifest.json`."""
+    metadata_path = Path(metadata_path)
+    return metadata_path.with_name(f"{metadata_path.stem}.manifest.json")
+
+
+def load_manifest(manifest_path):
+    """Loads a manifest, or returns None when there is no usable one."""
+    manifest_path = Path(manifest_path)
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(manifest, manifest_path):
+    manifest_path = Path(manifest_path)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    return manifest_path
+
+
+def update_index(inferencer, directory, metadata_path):
+    """Incrementally re-indexes a directory into `metadata_path`.
+
+    Only new or modified images are inferred. Unchanged files keep their
+    previous metadata as long as `model_id` and `conf_threshold` match the
+    last run, and entries for deleted files are dropped. A new or
+    touched file is read once: the same bytes are hashed and, if the
+    content changed, decoded for the model. With embeddings on, the
+    vectors of re-inferred and deleted files are removed from the
+    embedding index too. Returns the updated metadata list.
+    """
+    metadata_path = Path(metadata_path)
+    manifest_path = manifest_path_for(metadata_path)
+
+    # model_id covers everything else that changes the output, as for the result cache: the weights,
+    # backend, imgsz, max_det, quantization, tiling and reduced decode
+    model_settings = {
+        'model_id': inferencer.model_id,
+        'conf_threshold': inferencer.conf_threshold
+    }
+
+    manifest = load_manifest(manifest_path)
+    previous = {}
+    if manifest is not None and metadata_path.exists():
+        if all(manifest.get(key) == value for key, value in model_settings.items()):
+            previous = {item['image_path']: item for item in load_metadata(metadata_path)}
+        else:
+            print("Model settings changed since the last run, re-indexing everything")
+    old_files = manifest.get('files', {}) if previous else {}
+
+    files = {}
+    kept = {}
+    # New or modified images, inferred `batch_size` at a time from the bytes already read for hashing
+    pending = []
+    # Images the tiler reads band by band itself, so they are only hashed here
+    tiled = []
+    new_metadata = []
+    inferred = 0
+    embeddings = inferencer.embeddings
+
+    def flush():
+        images, names, hashes, sizes = [], [], [], []
+        for img_path, data, content_hash in pending:
+            try:
+                with inferencer.metrics.stage('decode'):
+                    image, full_size = inferencer.decode(data)
+            except ValueError:
+                inferencer._report_error(img_path, ValueError(f"cannot identify image file {img_path}"))
+                continue
+            images.append(image)
+            names.append(str(img_path))
+            hashes.append(content_hash)
+            sizes.append(full_size)
+        pending.clear()
+        if images:
+            new_metadata.extend(inferencer.process_arrays(images, names, hashes, image_sizes=sizes))
+
+    for img_path in find_images(directory, inferencer.extensions, **inferencer.walk_options):
+        key = str(img_path)
+        stat = os.stat(img_path)
+        entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        old = old_files.get(key) if key in previous else None
+
+        # Same size and mtime: trust it without reading the file
+        if old is not None and old['size'] == entry['size'] and old['mtime_ns'] == entry['mtime_ns']:
+            files[key] = old
+            kept[key] = previous[key]
+            continue
+
+        # New, or touched but maybe not changed: read once and compare content
+        try:
+            if inferencer.tiler is not None and inferencer.tiler.wants(img_path):
+                data = None
+                entry['sha256'] = file_hash(img_path)
+            else:
+                with inferencer.metrics.stage('read'):
+                    data = Path(img_path).read_bytes()
+                entry['sha256'] = hashlib.sha256(data).hexdigest()
+        except Exception as e:
+            inferencer._report_error(img_path, e)
+            continue
+        files[key] = entry
+        if old is not None and entry['sha256'] == old['sha256']:
+            kept[key] = previous[key]
+            continue
+
+        inferred += 1
+        if embeddings is not None:
+            # Otherwise the old vectors stay and the new ones are never added
+            embeddings.remove(key)
+        if data is None:
+            tiled.append(img_path)
+            continue
+        pending.append((img_path, data, entry['sha256']))
+        if len(pending) == inferencer.batch_size:
+            flush()
+    flush()
+    new_metadata.extend(inferencer.process_paths(tiled))
+
+    removed = len(set(previous) - set(files))
+    if embeddings is not None:
+        for image_path in [path for path in embeddings.image_paths if path in embeddings and path not in files]:
+            embeddings.remove(image_path)
+    print(f"Incremental index: {len(kept)} unchanged, {inferred} processed, {removed} removed")
+
+    # Images that failed are left out of the manifest so the next run retries them
+    processed = {item['image_path'] for item in new_metadata}
+    for key in [key for key in files if key not in kept and key not in processed]:
+        del files[key]
+
+    metadata = list(kept.values()) + new_metadata
+    metadata.sort(key=lambda item: item['image_path'])
+
+    save_metadata(metadata, metadata_path)
+    save_manifest({'version': MANIFEST_VERSION, **model_settings, 'files': files}, manifest_path)
+    inferencer.save_embeddings()
+    return metadata
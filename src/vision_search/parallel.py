@@ -0,0 +1,97 @@
+import os
+import copy
+import multiprocessing as mp
+from .utils import find_images, save_metadata, walk_options_from_config
+
+# Per-process model replica, created once by _init_worker
+_worker_inferencer = None
+
+
+def _init_worker(config, profile, num_threads):
+    """Loads one model replica per worker, built from the config like a serial run, and caps its threads."""
+    global _worker_inferencer
+
+    # Must happen before torch is imported in this process
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(num_threads)
+
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+        torch.set_num_interop_threads(1)
+    except (ImportError, RuntimeError):
+        pass
+
+    # ONNX Runtime left at 0 threads would use every core in every worker
+    config = copy.deepcopy(config)
+    onnx_options = config['model'].setdefault('onnx', {})
+    if not onnx_options.get('intra_op_threads'):
+        onnx_options['intra_op_threads'] = num_threads
+
+    from .registry import get_inferencer_from_config
+    _worker_inferencer = get_inferencer_from_config(config, profile=profile)
+
+
+def _process_shard(image_paths):
+    return _worker_inferencer.process_paths(image_paths)
+
+
+def iter_directory_parallel(directory, config, profile=None, num_workers=None, threads_per_worker=None,
+                            batch_size=None):
+    """Yields one metadata dict per image as the worker processes finish them.
+
+    Every worker builds its inferencer with `get_inferencer_from_config`,
+    so backend, input size, profile and result cache are the same as in a
+    serial run. The image list is split into shards of `batch_size` paths
+    and handed out to `num_workers` processes. Unset counts come from the
+    `indexing` section of the config. Raises ValueError if embeddings are
+    enabled.
+    """
+    if (config.get('embeddings') or {}).get('enabled', False):
+        # Each worker would fill its own EmbeddingIndex, which nothing merges or saves
+        raise ValueError("Embeddings are not supported by the parallel indexer; index serially to build them")
+    indexing = config.get('indexing') or {}
+    threads_per_worker = max(1, int(threads_per_worker or indexing.get('threads_per_worker') or 1))
+    num_workers = num_workers or indexing.get('num_workers')
+    if not num_workers:
+        num_workers = max(1, (os.cpu_count() or 1) // threads_per_worker)
+    batch_size = max(1, int(batch_size or config['model'].get('batch_size', 1)))
+
+    image_paths = [str(p) for p in find_images(directory, config['data']['image_extension'],
+                                               **walk_options_from_config(config))]
+    if not image_paths:
+        return
+    shards = [image_paths[i:i + batch_size] for i in range(0, len(image_paths), batch_size)]
+    num_workers = min(num_workers, len(shards))
+
+    # spawn gives every worker a clean torch runtime instead of a forked one
+    ctx = mp.get_context('spawn')
+    with ctx.Pool(
+        processes=num_workers,
+        initializer=_init_worker,
+        initargs=(config, profile, threads_per_worker)
+    ) as pool:
+        for shard_metadata in pool.imap_unordered(_process_shard, shards):
+            yield from shard_metadata
+
+
+def process_directory_parallel(directory, config, profile=None, num_workers=None, threads_per_worker=None,
+                               batch_size=None, output_path=None):
+    """Indexes a directory with a pool of worker processes.
+
+    Returns the merged metadata, in the same format `save_metadata` writes,
+    and saves it to `output_path` when one is given.
+    """
+    metadata = list(iter_directory_parallel(
+        directory, config,
+        profile=profile,
+        num_workers=num_workers,
+        threads_per_worker=threads_per_worker,
+        batch_size=batch_size
+    ))
+    # Workers finish out of order; keep the output stable between runs
+    metadata.sort(key=lambda item: item['image_path'])
+
+    if output_path is not None:
+        save_metadata(metadata, output_path)
+    return metadata
@@ -0,0 +1,177 @@
+import hashlib
+import io
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+import cv2
+import numpy as np
+from .utils import iter_images
+
+
+def load_image(image_path):
+    """Reads and decodes one image to a BGR array; also returns the sha256 of its bytes."""
+    data = Path(image_path).read_bytes()
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"cannot decode image {image_path}")
+    return image, hashlib.sha256(data).hexdigest()
+
+
+# JPEG DCT-domain scaling: libjpeg decodes straight to 1/2, 1/4 or 1/8 size
+_REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def _jpeg_size(data):
+    """(width, height) of a JPEG from its header, after EXIF rotation like OpenCV applies it."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+        orientation = image.getexif().get(0x0112, 1)
+    return (height, width) if orientation in (5, 6, 7, 8) else (width, height)
+
+
+def decode_reduced(data, min_size=None, max_size=None):
+    """Decodes encoded bytes, JPEGs at the smallest DCT scale whose longer side is still >= `min_size`.
+
+    Returns the BGR array and the (width, height) of the full-resolution
+    image, which boxes found on the array are scaled back to. Other
+    formats, `min_size=None`, or JPEGs whose longer side exceeds
+    `max_size` (images that will be tiled), decode at full size.
+    """
+    factor = 1
+    if min_size and data[:2] == b'\xff\xd8':
+        try:
+            full_size = _jpeg_size(data)
+            if max_size is None or max(full_size) <= max_size:
+                factor = next((f for f in (8, 4, 2) if -(-max(full_size) // f) >= min_size), 1)
+        except Exception:
+            pass
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), _REDUCED_FLAGS.get(factor, cv2.IMREAD_COLOR))
+    if image is None:
+        raise ValueError("cannot decode image bytes")
+    if factor == 1:
+        full_size = (image.shape[1], image.shape[0])
+    return image, full_size
+
+
+def decode_image(source):
+    """Turns encoded bytes, a PIL image or a NumPy array into a BGR uint8 array.
+
+    Also returns the sha256 of the encoded bytes, which keys the result
+    cache, or None for already-decoded inputs. Arrays are taken to be BGR,
+    as OpenCV returns them; grayscale and BGRA arrays are converted.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        image = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("cannot decode image bytes")
+        return image, hashlib.sha256(source).hexdigest()
+
+    if isinstance(source, np.ndarray):
+        image = source
+    elif hasattr(source, 'convert'):
+        # A PIL image, without importing PIL here
+        return cv2.cvtColor(np.asarray(source.convert('RGB')), cv2.COLOR_RGB2BGR), None
+    else:
+        raise TypeError(f"Unsupported image input: {type(source).__name__}")
+
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    elif image.shape[2] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    return np.ascontiguousarray(image), None
+
+
+def iter_prefetched(inferencer, image_paths, prefetch=32, num_threads=4, batch_size=None, ordered=True):
+    """Yields one metadata dict per image while a thread pool decodes ahead of the model.
+
+    At most `prefetch` images are read or waiting in memory at any time, so
+    a slow model pauses reading instead of buffering the whole directory.
+    Results come back in input order when `ordered`, otherwise in the
+    order images finish decoding. Unreadable images are reported and
+    skipped, as in `process_directory`. Readers hash each file before
+    decoding it, so result-cache hits skip both the decode and the model.
+    """
+    batch_size = max(1, int(batch_size or inferencer.batch_size))
+    prefetch = max(batch_size, int(prefetch))
+    paths = iter(image_paths)
+    batch = []
+    misses = 0
+
+    def run(batch):
+        todo = [entry for entry in batch if entry[4] is None]
+        inferred = {}
+        if todo:
+            images, names, hashes, sizes, _ = zip(*todo)
+            # process_arrays retries a failed batch image by image itself
+            for metadata in inferencer.process_arrays(list(images), list(names), list(hashes),
+                                                      image_sizes=list(sizes)):
+                inferred[metadata['image_path']] = metadata
+        # Cache hits were answered by the readers; keep them in input order with the rest
+        return [cached if cached is not None else inferred[name]
+                for _, name, _, _, cached in batch if cached is not None or name in inferred]
+
+    with ThreadPoolExecutor(max_workers=max(1, int(num_threads))) as pool:
+        pending = deque() if ordered else {}
+
+        def submit_next():
+            img_path = next(paths, None)
+            if img_path is None:
+                return False
+            future = pool.submit(inferencer.read_image, img_path)
+            if ordered:
+                pending.append((img_path, future))
+            else:
+                pending[future] = img_path
+            return True
+
+        while len(pending) < prefetch and submit_next():
+            pass
+
+        while pending:
+            if ordered:
+                ready = [pending.popleft()]
+            else:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                ready = [(pending.pop(future), future) for future in done]
+
+            for img_path, future in ready:
+                # Backpressure: a new read starts only when one is consumed
+                submit_next()
+                try:
+                    image, content_hash, full_size, cached = future.result()
+                except Exception as e:
+                    inferencer._report_error(img_path, e)
+                    continue
+                batch.append((image, str(img_path), content_hash, full_size, cached))
+                misses += cached is None
+                # Full model batches; cache hits alone flush every `prefetch` images
+                if misses == batch_size or len(batch) == prefetch:
+                    yield from run(batch)
+                    batch = []
+                    misses = 0
+
+        if batch:
+            yield from run(batch)
+
+
+def prefetch_options_from_config(config):
+    """`iter_prefetched` keyword arguments from the `indexing` section of default.yaml, or None if prefetch is off."""
+    indexing = config.get('indexing') or {}
+    if not indexing.get('prefetch'):
+        return None
+    return {
+        'prefetch': indexing['prefetch'],
+        'num_threads': indexing.get('decode_threads', 4),
+        'ordered': indexing.get('ordered', True)
+    }
+
+
+def iter_directory_prefetched(inferencer, directory, walk_options=None, **kwargs):
+    """`iter_prefetched` over the images `process_directory` would pick up.
+
+    Discovery is lazy, so inference starts before the walk finishes.
+    """
+    image_paths = iter_images(directory, inferencer.extensions, **(walk_options or {}))
+    return iter_prefetched(inferencer, image_paths, **kwargs)
@@ -0,0 +1,186 @@
+"""Named inference profiles and latency-budget calibration.
+
+A profile picks a model variant, input size, backend, optional INT8
+quantization and a max-detections cap (see `profiles` in default.yaml).
+Calibration measures each profile's CPU latency and its agreement with
+the reference profile, then picks the most accurate one within a budget:
+
+    python -m src.vision_search.profiles --images data/calibration --budget-ms 80
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+import numpy as np
+from .config import load_config
+from .utils import find_images
+from .pipeline import load_image
+
+PROFILE_KEYS = ('model_path', 'backend', 'imgsz', 'quantize', 'max_det')
+
+
+def resolve_profile(config, name):
+    """The `model` section of the config with profile `name` applied on top."""
+    profiles = config.get('profiles') or {}
+    if name not in profiles:
+        raise KeyError(f"Unknown inference profile: {name}")
+    settings = dict(config['model'])
+    settings.update(profiles[name] or {})
+    settings['profile'] = name
+    return settings
+
+
+def build_inferencer(config, name, **overrides):
+    """Creates a fresh YOLOv11Inference for profile `name` (not shared through the registry)."""
+    from .inference import YOLOv11Inference
+
+    settings = resolve_profile(config, name)
+    settings.update(overrides)
+    backend = settings.get('backend', 'torch')
+    return YOLOv11Inference(
+        model_path=settings['model_path'],
+        conf_threshold=settings['conf_threshold'],
+        image_extensions=config['data']['image_extension'],
+        device=settings.get('device', 'cpu'),
+        batch_size=settings.get('batch_size', 1),
+        backend=backend,
+        backend_options=settings.get(backend),
+        imgsz=settings.get('imgsz'),
+        max_det=settings.get('max_det', 300),
+        quantize=settings.get('quantize'),
+        calibration_images=settings.get('calibration_images'),
+        tiling=settings.get('tiling'),
+        reduced_decode=settings.get('reduced_decode', False)
+    )
+
+
+def _iou(box, boxes):
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / (area + areas - inter + 1e-9)
+
+
+def agreement(reference, candidate, iou_threshold=0.5):
+    """F1 between two metadata dicts: same class and IoU >= `iou_threshold` counts as a match."""
+    ref = reference['detections']
+    cand = sorted(candidate['detections'], key=lambda det: -det['confidence'])
+    if not ref and not cand:
+        return 1.0
+    if not ref or not cand:
+        return 0.0
+
+    ref_boxes = np.array([det['bbox'] for det in ref], dtype=np.float32)
+    ref_classes = np.array([det['class'] for det in ref])
+    matched = np.zeros(len(ref), dtype=bool)
+    hits = 0
+    for det in cand:
+        iou = _iou(np.asarray(det['bbox'], dtype=np.float32), ref_boxes)
+        iou[(ref_classes != det['class']) | matched] = 0
+        best = int(iou.argmax())
+        if iou[best] >= iou_threshold:
+            matched[best] = True
+            hits += 1
+    return 2 * hits / (len(ref) + len(cand))
+
+
+def calibrate(config, image_paths, reference='reference', profiles=None, warmup=2, calibration_images=None):
+    """Measures latency and agreement with the `reference` profile for each profile.
+
+    Images are decoded once up front so only the profile-dependent part
+    (preprocess, forward pass, post-processing) is timed. INT8 profiles
+    whose quantized model has to be built are calibrated on
+    `calibration_images` if given, instead of `model.calibration_images`.
+    """
+    overrides = {} if calibration_images is None else {'calibration_images': list(calibration_images)}
+    images, names = [], []
+    for img_path in image_paths:
+        try:
+            images.append(load_image(img_path)[0])
+            names.append(str(img_path))
+        except Exception as e:
+            print(f"Skipping {img_path}: {str(e)}")
+    profiles = list(profiles or (config.get('profiles') or {}))
+
+    ref_model = build_inferencer(config, reference, **overrides)
+    # One image per call, like the timed runs below, so the reference scores 1.0 against itself
+    expected = [ref_model.process_arrays([image], [img_path])[0] for image, img_path in zip(images, names)]
+    del ref_model
+
+    report = []
+    for name in profiles:
+        inferencer = build_inferencer(config, name, **overrides)
+        for _ in range(warmup):
+            inferencer.warmup()
+
+        latencies = []
+        scores = []
+        for image, img_path, ref in zip(images, names, expected):
+            start = time.perf_counter()
+            result = inferencer.process_arrays([image], [img_path])[0]
+            latencies.append((time.perf_counter() - start) * 1000)
+            scores.append(agreement(ref, result))
+
+        latencies = np.asarray(latencies)
+        report.append({
+            'profile': name,
+            'settings': {key: resolve_profile(config, name).get(key) for key in PROFILE_KEYS},
+            'mean_ms': float(latencies.mean()),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'agreement_f1': float(np.mean(scores))
+        })
+        print(f"{name}: p50 {report[-1]['p50_ms']:.1f} ms, p95 {report[-1]['p95_ms']:.1f} ms, "
+              f"agreement {report[-1]['agreement_f1']:.3f}")
+    return report
+
+
+def select_profile(report, budget_ms, latency_key='p95_ms'):
+    """Most accurate profile whose latency fits the budget; the fastest one if none does."""
+    within = [entry for entry in report if entry[latency_key] <= budget_ms]
+    if not within:
+        return min(report, key=lambda entry: entry[latency_key])
+    return max(within, key=lambda entry: (entry['agreement_f1'], -entry[latency_key]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default='config/default.yaml')
+    parser.add_argument('--images', required=True, help='directory of calibration images')
+    parser.add_argument('--budget-ms', type=float, required=True, help='per-image latency budget')
+    parser.add_argument('--latency', default='p95_ms', choices=['mean_ms', 'p50_ms', 'p95_ms'])
+    parser.add_argument('--reference', default='reference')
+    parser.add_argument('--max-images', type=int, default=50)
+    parser.add_argument('--output', default=None, help='write the calibration report as JSON')
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    image_paths = find_images(args.images, config['data']['image_extension'])[:args.max_images]
+    if not image_paths:
+        raise SystemExit(f"No images found in {args.images}")
+
+    # The timing sample doubles as the INT8 calibration set when the configured one is missing
+    configured = config['model'].get('calibration_images')
+    calibration_images = None if configured and Path(configured).is_dir() else image_paths
+    report = calibrate(config, image_paths, reference=args.reference, calibration_images=calibration_images)
+    chosen = select_profile(report, args.budget_ms, args.latency)
+    fits = chosen[args.latency] <= args.budget_ms
+    print(f"\nSelected profile: {chosen['profile']}"
+          + ("" if fits else f" (nothing fits {args.budget_ms:g} ms; this is the fastest)"))
+
+    if args.output:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump({'budget_ms': args.budget_ms, 'latency': args.latency,
+                       'selected': chosen['profile'], 'profiles': report}, f, indent=2)
+    return chosen
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import json
+import threading
+from functools import partial
+from .inference import YOLOv11Inference
+from .cache import cache_from_config
+from .profiles import resolve_profile
+from .embeddings import embeddings_from_config
+from .pipeline import prefetch_options_from_config
+from .utils import walk_options_from_config
+
+# One model per (model_path, device, conf_threshold, backend, imgsz, max_det,
+# quantize, embeddings on/off, tiling, reduced_decode, prefetch, walk options), shared by every session
+# of the server process
+_models = {}
+_lock = threading.Lock()
+# Background loads started by `preload_from_config`, one per config and profile
+_preloads = {}
+# Separate from `_lock`, which is held for the whole of a load
+_preload_lock = threading.Lock()
+
+
+def get_inferencer(model_path, conf_threshold, image_extensions, device='cpu', batch_size=1, warmup=True,
+                   cache=None, backend='torch', backend_options=None, imgsz=None, max_det=300, quantize=None,
+                   calibration_images=None, embeddings=None, tiling=None, reduced_decode=False,
+                   prefetch_options=None, walk_options=None):
+    """Returns the process-wide inferencer for these settings, loading it on first use.
+
+    `cache` is a ResultCache and `embeddings` an EmbeddingIndex, or
+    callables returning one; both are only attached when the model is
+    first loaded.
+    """
+    key = (str(model_path), device, float(conf_threshold), backend, imgsz, max_det, quantize,
+           embeddings is not None, tuple(sorted((tiling or {}).items())), bool(reduced_decode),
+           tuple(sorted((prefetch_options or {}).items())),
+           tuple(sorted((name, tuple(value) if isinstance(value, list) else value)
+                        for name, value in (walk_options or {}).items())))
+    inferencer = _models.get(key)
+    if inferencer is not None:
+        return inferencer
+
+    with _lock:
+        # Another thread may have loaded it while we waited
+        inferencer = _models.get(key)
+        if inferencer is None:
+            if callable(cache):
+                cache = cache()
+            if callable(embeddings):
+                embeddings = embeddings()
+            inferencer = YOLOv11Inference(
+                model_path=model_path,
+                conf_threshold=conf_threshold,
+                image_extensions=image_extensions,
+                device=device,
+                batch_size=batch_size,
+                cache=cache,
+                backend=backend,
+                backend_options=backend_options,
+                imgsz=imgsz,
+                max_det=max_det,
+                quantize=quantize,
+                calibration_images=calibration_images,
+                embeddings=embeddings,
+                tiling=tiling,
+                reduced_decode=reduced_decode,
+                prefetch_options=prefetch_options,
+                walk_options=walk_options
+            )
+            if warmup:
+                inferencer.warmup()
+            _models[key] = inferencer
+    return inferencer
+
+
+def get_inferencer_from_config(config, profile=None):
+    """Builds the registry key from the `model`, `data` and `indexing` sections of default.yaml.
+
+    `profile` (or `model.profile`) names an entry under `profiles` whose
+    settings override the `model` section.
+    """
+    model_config = config['model']
+    profile = profile or model_config.get('profile')
+    if profile:
+        model_config = resolve_profile(config, profile)
+    backend = model_config.get('backend', 'torch')
+    embeddings_enabled = (config.get('embeddings') or {}).get('enabled', False)
+    return get_inferencer(
+        model_path=model_config['model_path'],
+        conf_threshold=model_config['conf_threshold'],
+        image_extensions=config['data']['image_extension'],
+        device=model_config.get('device', 'cpu'),
+        batch_size=model_config.get('batch_size', 1),
+        warmup=model_config.get('warmup', True),
+        cache=partial(cache_from_config, config),
+        backend=backend,
+        # Per-backend options live under a key named after the backend, e.g. `onnx:`
+        backend_options=model_config.get(backend),
+        imgsz=model_config.get('imgsz'),
+        max_det=model_config.get('max_det', 300),
+        quantize=model_config.get('quantize'),
+        calibration_images=model_config.get('calibration_images'),
+        embeddings=partial(embeddings_from_config, config) if embeddings_enabled else None,
+        tiling=model_config.get('tiling'),
+        reduced_decode=model_config.get('reduced_decode', False),
+        prefetch_options=prefetch_options_from_config(config),
+        walk_options=walk_options_from_config(config)
+    )
+
+
+def preload_from_config(config, profile=None):
+    """Loads and warms up the model from `config` in a background thread; returns the thread.
+
+    Only the first call for a given config and profile starts a thread, so
+    a script that runs again on every interaction (Streamlit) can call it
+    at the top. A later `get_inferencer_from_config` with the same config
+    waits for that load instead of starting a second one.
+    """
+    key = (json.dumps(config, sort_keys=True, default=str), profile)
+    with _preload_lock:
+        thread = _preloads.get(key)
+        if thread is None:
+            def load():
+                try:
+                    get_inferencer_from_config(config, profile=profile)
+                except Exception as e:
+                    # The first real request loads again and reports the error to the user
+                    print(f"Error preloading model: {str(e)}")
+
+            thread = _preloads[key] = threading.Thread(target=load, name='model-preload', daemon=True)
+            thread.start()
+    return thread
+
+
+def clear_registry():
+    """Drops every loaded model, e.g. after the weights changed on disk."""
+    with _lock:
+        _models.clear()
+    with _preload_lock:
+        _preloads.clear()
@@ -0,0 +1,177 @@
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import cv2
+import numpy as np
+
+ENCODINGS = {
+    'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY)
+}
+
+# One renderer per settings, shared by every session of the server process
+_renderers = {}
+_lock = threading.Lock()
+
+
+def render_key(content_hash, detections, max_size, fmt, quality):
+    """Key of one rendered image: image content + the boxes drawn + output settings."""
+    boxes = [(det['class'], round(det['confidence'], 2), [round(v, 1) for v in det['bbox']])
+             for det in detections]
+    raw = f"{content_hash}|{json.dumps(boxes)}|{max_size}|{fmt}|{quality}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def fit(image, max_size):
+    """Downsamples a BGR array so its longer side is at most `max_size`; returns it and the scale."""
+    height, width = image.shape[:2]
+    scale = min(1.0, max_size / max(height, width)) if max_size else 1.0
+    if scale < 1.0:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    return image, scale
+
+
+def draw_detections(image, detections, scale=1.0, color=(0, 0, 255), thickness=2):
+    """Draws labelled boxes in place; `bbox` values are scaled by `scale` first."""
+    font_scale = 0.5
+    for det in detections:
+        x1, y1, x2, y2 = (int(round(v * scale)) for v in det['bbox'])
+        cv2.rectangle(image, (x1, y1), (x2, y2), color, thickness)
+        label = f"{det['class']} {det['confidence']:.2f}"
+        (w, h), baseline = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 1)
+        # Label above the box, or inside it at the top edge of the image
+        top = y1 - h - baseline if y1 - h - baseline >= 0 else y1
+        cv2.rectangle(image, (x1, top), (x1 + w, top + h + baseline), color, cv2.FILLED)
+        cv2.putText(image, label, (x1, top + h), cv2.FONT_HERSHEY_SIMPLEX, font_scale,
+                    (255, 255, 255), 1, cv2.LINE_AA)
+    return image
+
+
+class Renderer:
+    """Annotated, display-sized JPEG/WebP renders of detection results.
+
+    The image is downsampled to `max_size` before the boxes are drawn, so
+    the cost follows the display size rather than the camera resolution.
+    Encoded renders are kept in an LRU of `cache_items` entries keyed by
+    image hash plus detection set.
+    """
+
+    def __init__(self, max_size=1280, fmt='jpeg', quality=85, cache_items=512, thumbnail_size=320):
+        if fmt not in ENCODINGS:
+            raise ValueError(f"Unsupported render format: {fmt}")
+        self.max_size = max_size
+        self.thumbnail_size = thumbnail_size
+        self.fmt = fmt
+        self.quality = int(quality)
+        self.cache_items = max(0, int(cache_items))
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def encode(self, image):
+        suffix, flag = ENCODINGS[self.fmt]
+        ok, buffer = cv2.imencode(suffix, image, [flag, self.quality])
+        if not ok:
+            raise ValueError(f"cannot encode image as {self.fmt}")
+        return buffer.tobytes()
+
+    def render(self, image, detections, content_hash=None, max_size=None, image_size=None):
+        """Encoded render of a BGR array with its detections drawn.
+
+        The input array is not modified. Without `content_hash` nothing is
+        cached, since the pixels themselves are not hashed. `image_size` is
+        the (width, height) the boxes refer to, when `image` is a reduced
+        decode of a larger original.
+        """
+        max_size = max_size or self.max_size
+        key = None
+        if content_hash is not None:
+            key = render_key(content_hash, detections, max_size, self.fmt, self.quality)
+            cached = self._get(key)
+            if cached is not None:
+                return cached
+
+        small, scale = fit(image, max_size)
+        if small is image:
+            small = image.copy()
+        if image_size is not None:
+            scale = small.shape[1] / image_size[0]
+        data = self.encode(draw_detections(small, detections, scale))
+        if key is not None:
+            self._put(key, data)
+        return data
+
+    def render_file(self, image_path, detections, max_size=None):
+        """Gallery thumbnail (`thumbnail_size` unless `max_size` is given) of an image file, cached by content."""
+        max_size = max_size or self.thumbnail_size
+        data = Path(image_path).read_bytes()
+        key = render_key(hashlib.sha256(data).hexdigest(), detections, max_size, self.fmt, self.quality)
+        cached = self._get(key)
+        if cached is not None:
+            return cached
+
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"cannot decode image {image_path}")
+        small, scale = fit(image, max_size)
+        rendered = self.encode(draw_detections(small, detections, scale))
+        self._put(key, rendered)
+        return rendered
+
+    def _get(self, key):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def _put(self, key, value):
+        if self.cache_items == 0:
+            return
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_items:
+                self._cache.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'items': len(self._cache),
+                'bytes': sum(len(value) for value in self._cache.values()),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def get_renderer(max_size=1280, fmt='jpeg', quality=85, cache_items=512, thumbnail_size=320):
+    """Returns the process-wide renderer for these settings, so its cache outlives a Streamlit rerun."""
+    key = (max_size, fmt, int(quality), int(cache_items), thumbnail_size)
+    with _lock:
+        renderer = _renderers.get(key)
+        if renderer is None:
+            renderer = _renderers[key] = Renderer(max_size, fmt, quality, cache_items, thumbnail_size)
+        return renderer
+
+
+def renderer_from_config(config):
+    """Builds the shared renderer from the `render` section of default.yaml."""
+    render_config = config.get('render') or {}
+    return get_renderer(
+        max_size=render_config.get('max_size', 1280),
+        fmt=render_config.get('format', 'jpeg'),
+        quality=render_config.get('quality', 85),
+        cache_items=render_config.get('cache_items', 512),
+        thumbnail_size=render_config.get('thumbnail_size', 320)
+    )
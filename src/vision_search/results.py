@@ -0,0 +1,97 @@
+import numpy as np
+
+
+class DetectionResult:
+    """Array-backed detections for one image.
+
+    `class_ids` (int32), `confidences` (float32) and `boxes` (float32 Nx4
+    xyxy) are filled with one tensor-to-NumPy transfer. `image_size` is the
+    (width, height) the boxes refer to. When embeddings are enabled,
+    `embedding` is the image vector and `box_embeddings` holds one row per
+    box. `to_dict()` gives the metadata dict `process_image` returns.
+    """
+
+    __slots__ = ('image_path', 'class_ids', 'confidences', 'boxes', 'names', 'image_size',
+                 'embedding', 'box_embeddings')
+
+    def __init__(self, image_path, class_ids, confidences, boxes, names, image_size=None):
+        self.image_path = str(image_path)
+        self.class_ids = class_ids
+        self.confidences = confidences
+        self.boxes = boxes
+        self.names = names
+        self.image_size = image_size
+        self.embedding = None
+        self.box_embeddings = None
+
+    @classmethod
+    def from_ultralytics(cls, result, image_path):
+        """Builds the result from one ultralytics `Results` object."""
+        boxes = result.boxes
+        if boxes is None or len(boxes) == 0:
+            data = np.empty((0, 6), dtype=np.float32)
+        else:
+            # Columns: x1, y1, x2, y2, conf, cls
+            data = boxes.data.cpu().numpy()
+        return cls(
+            image_path,
+            data[:, 5].astype(np.int32),
+            np.ascontiguousarray(data[:, 4], dtype=np.float32),
+            np.ascontiguousarray(data[:, :4], dtype=np.float32),
+            result.names,
+            (int(result.orig_shape[1]), int(result.orig_shape[0]))
+        )
+
+    @classmethod
+    def empty(cls, image_path, names=None, image_size=None):
+        return cls(
+            image_path,
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.float32),
+            np.empty((0, 4), dtype=np.float32),
+            names or {},
+            image_size
+        )
+
+    def __len__(self):
+        return len(self.class_ids)
+
+    def _unique_classes(self):
+        """Class ids in order of first appearance, their counts and each row's slot."""
+        ids, first, inverse, counts = np.unique(
+            self.class_ids, return_index=True, return_inverse=True, return_counts=True)
+        order = np.argsort(first, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        return ids[order], counts[order], rank[inverse.reshape(-1)]
+
+    def class_counts(self):
+        ids, counts, _ = self._unique_classes()
+        return {self.names[int(c)]: int(n) for c, n in zip(ids.tolist(), counts.tolist())}
+
+    def to_dict(self):
+        ids, counts, slot = self._unique_classes()
+        labels = [self.names[int(c)] for c in ids.tolist()]
+        class_counts = dict(zip(labels, counts.tolist()))
+        row_counts = counts[slot].tolist()
+
+        detection = [
+            {
+                'class': labels[s],
+                'confidence': conf,
+                'bbox': bbox,
+                'count': count
+            }
+            for s, conf, bbox, count in zip(
+                slot.tolist(), self.confidences.tolist(), self.boxes.tolist(), row_counts)
+        ]
+        metadata = {
+            'image_path': self.image_path,
+            'detections': detection,
+            'total_objects': len(detection),
+            'unique_class': labels,
+            'class_counts': class_counts
+        }
+        if self.image_size is not None:
+            metadata['image_size'] = list(self.image_size)
+        return metadata
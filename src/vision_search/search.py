@@ -0,0 +1,113 @@
+"""Metadata search without the model: loads an index and answers class/spatial queries.
+
+Nothing here imports torch, ultralytics or OpenCV, so a search-only process
+starts in a fraction of the time a detection process needs:
+
+    python -m src.vision_search.search --metadata data/processed/metadata.json \
+        --query '{"terms": [{"class": "person", "min_count": 2}], "mode": "all"}'
+"""
+
+import json
+import argparse
+from pathlib import Path
+from .config import load_config
+from .index import MetadataIndex, Term, And, Or, Not
+from .spatial import Region, Area, Overlap
+from .utils import load_metadata
+
+
+def load_search_index(metadata_path):
+    """A MetadataIndex from a saved `.npz` index or any metadata file `load_metadata` reads.
+
+    Indexes built from metadata files also get a spatial index, for the
+    region/area/overlap terms; a saved index keeps the one it was saved with.
+    """
+    metadata_path = Path(metadata_path)
+    if metadata_path.suffix == '.npz':
+        return MetadataIndex.load(metadata_path)
+    return MetadataIndex.build(load_metadata(metadata_path), spatial=True)
+
+
+def parse_query(body):
+    """Builds a Term/And/Or query from a search request dict; raises ValueError if it is malformed.
+
+    `terms` are Term keyword arguments with `class` for the class name;
+    `mode` is "all" (AND, default) or "any" (OR); `exclude` terms are negated.
+    A term with `region` ([x1, y1, x2, y2] normalized, plus `region_mode`),
+    `overlaps` (another class, with `min_cover` or `min_iou`) or
+    `min_area`/`max_area` (fraction of the frame) is a spatial predicate.
+    """
+    def term(spec):
+        if not isinstance(spec, dict) or 'class' not in spec:
+            raise ValueError("Each term needs a 'class'")
+        common = {'min_count': spec.get('min_count', 1), 'min_confidence': spec.get('min_confidence')}
+        try:
+            if 'region' in spec:
+                return Region(spec['class'], spec['region'], mode=spec.get('region_mode', 'intersects'), **common)
+            if 'overlaps' in spec:
+                return Overlap(spec['class'], spec['overlaps'], min_cover=spec.get('min_cover', 0.5),
+                               min_iou=spec.get('min_iou'), **common)
+            if 'min_area' in spec or 'max_area' in spec:
+                return Area(spec['class'], spec.get('min_area', 0.0), spec.get('max_area', 1.0), **common)
+        except TypeError as e:
+            raise ValueError(str(e))
+        return Term(
+            spec['class'],
+            min_count=spec.get('min_count', 1),
+            max_count=spec.get('max_count'),
+            min_confidence=spec.get('min_confidence')
+        )
+
+    terms = [term(spec) for spec in body.get('terms', [])]
+    exclude = [Not(term(spec)) for spec in body.get('exclude', [])]
+    if not terms and not exclude:
+        raise ValueError("No search terms given")
+    mode = body.get('mode', 'all')
+    if mode not in ('all', 'any'):
+        raise ValueError("mode must be 'all' or 'any'")
+
+    query = (And if mode == 'all' else Or)(*terms) if terms else None
+    if exclude:
+        query = And(query, *exclude) if query is not None else And(*exclude)
+    return query
+
+
+def search(index, request):
+    """Runs a search request dict against `index`; returns the match count and the (optionally `limit`ed) paths."""
+    ids = index.search_ids(parse_query(request))
+    limit = request.get('limit')
+    return {
+        'count': int(len(ids)),
+        'image_paths': [index.image_paths[i] for i in (ids if limit is None else ids[:int(limit)])]
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default='config/default.yaml')
+    parser.add_argument('--metadata', default=None, help='metadata file or .npz index to search')
+    parser.add_argument('--query', required=True, help='search request as JSON, as POSTed to /search')
+    parser.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    metadata_path = args.metadata
+    if metadata_path is None:
+        config = load_config(args.config)
+        metadata_path = (config.get('server') or {}).get('metadata_path')
+    if not metadata_path:
+        parser.error("--metadata is required when the config sets no server.metadata_path")
+
+    request = json.loads(args.query)
+    if args.limit is not None:
+        request['limit'] = args.limit
+    try:
+        result = search(load_search_index(metadata_path), request)
+    except ValueError as e:
+        print(f"Invalid query: {str(e)}")
+        return None
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == "__main__":
+    main()
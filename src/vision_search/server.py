@@ -0,0 +1,389 @@
+"""Headless HTTP detection/search service.
+
+    python -m src.vision_search.server --config config/default.yaml
+
+POST /detect   raw image bytes (optional ?name=label) -> metadata + timing
+POST /search   {"terms": [{"class": "person", "min_count": 2}], "mode": "all"}
+GET  /health   queue depth
+GET  /metrics  Prometheus text
+
+With --search-only no model is loaded (torch is never imported) and only
+/search, /health and /metrics are served.
+
+Concurrent detect requests are coalesced into one predict call per batch;
+when the batch queue is full new requests get 503 instead of waiting.
+"""
+
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+from .config import load_config
+from .instrumentation import Instrumentation
+from .search import load_search_index, search
+
+MAX_HEADERS = 100
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or HTTPStatus(status).phrase)
+        self.status = status
+
+
+class MicroBatcher:
+    """Coalesces concurrent `detect` calls into batched `process_arrays` calls.
+
+    A batch is closed after `max_batch` images or `max_wait_ms` after its
+    first image, whichever comes first. Requests arriving while a batch runs
+    wait in a queue of at most `max_queue` entries.
+    """
+
+    def __init__(self, inferencer, max_batch=16, max_wait_ms=5, max_queue=256):
+        self.inferencer = inferencer
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max(1, int(max_queue))
+        self.queue = None
+        # The model is not thread-safe: every batch runs on this one thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='inference')
+        self._ids = itertools.count()
+        self._task = None
+
+    def start(self):
+        self.queue = asyncio.Queue(self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=True)
+
+    async def detect(self, image, content_hash=None, image_size=None):
+        """Returns (metadata or None, timing dict) once this image's batch has run.
+
+        `image_size` is the full-resolution (width, height) of a reduced decode.
+        """
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((image, content_hash, image_size, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.inferencer.metrics.incr('requests_shed')
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Detection queue is full, retry later")
+        return await future
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Whatever piled up meanwhile joins without any further wait
+        while len(batch) < self.max_batch and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        # Requests that already timed out are not worth a forward pass
+        return [item for item in batch if not item[3].done()]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            if not batch:
+                continue
+            images, hashes, sizes, futures, enqueued = zip(*batch)
+            names = [f"request-{next(self._ids)}" for _ in batch]
+            # Only pass hashes if every image has one, so the result cache is used
+            hashes = list(hashes) if all(hashes) else None
+
+            started = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, partial(self.inferencer.process_arrays, list(images), names, hashes,
+                                            image_sizes=list(sizes)))
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            by_name = {item['image_path']: item for item in results}
+            for name, future, queued_at in zip(names, futures, enqueued):
+                if future.done():
+                    continue
+                self.inferencer.metrics.observe('queue_wait', started - queued_at)
+                future.set_result((by_name.get(name), {
+                    'queue_ms': (started - queued_at) * 1000,
+                    'inference_ms': (finished - started) * 1000,
+                    'batch_size': len(batch)
+                }))
+
+
+def decode_upload(inferencer, data):
+    """Decodes an uploaded image for the model; returns the array, its sha256 and full-resolution size."""
+    try:
+        image, full_size = inferencer.decode(data)
+    except ValueError:
+        raise HTTPError(HTTPStatus.UNPROCESSABLE_ENTITY, "Cannot decode image")
+    return image, hashlib.sha256(data).hexdigest(), full_size
+
+
+class DetectionServer:
+    """asyncio HTTP/1.1 server (keep-alive, Content-Length bodies) over one inferencer.
+
+    With `inferencer=None` it is a search-only server: no model is loaded
+    and `/detect` is not routed.
+    """
+
+    def __init__(self, inferencer, index=None, max_batch=16, max_wait_ms=5, max_queue=256,
+                 max_body_mb=20, request_timeout_s=30, decode_threads=4):
+        self.inferencer = inferencer
+        self.index = index
+        self._metrics = inferencer.metrics if inferencer is not None else Instrumentation()
+        self.batcher = MicroBatcher(inferencer, max_batch, max_wait_ms, max_queue) if inferencer is not None else None
+        self.max_body = int(max_body_mb * 1024 * 1024)
+        self.request_timeout = request_timeout_s
+        self._decoder = ThreadPoolExecutor(max_workers=max(1, int(decode_threads)), thread_name_prefix='decode')
+        self._server = None
+        self.routes = {
+            ('POST', '/search'): self.search,
+            ('GET', '/health'): self.health,
+            ('GET', '/metrics'): self.metrics
+        }
+        if inferencer is not None:
+            self.routes[('POST', '/detect')] = self.detect
+
+    async def start(self, host='127.0.0.1', port=8000):
+        if self.batcher is not None:
+            self.batcher.start()
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server
+
+    @property
+    def port(self):
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self.batcher is not None:
+            await self.batcher.stop()
+        self._decoder.shutdown(wait=True)
+
+    async def detect(self, query, body):
+        if not body:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Send the image bytes as the request body")
+        start = time.perf_counter()
+        image, content_hash, full_size = await asyncio.get_running_loop().run_in_executor(
+            self._decoder, decode_upload, self.inferencer, body)
+        decoded = time.perf_counter()
+
+        try:
+            metadata, timing = await asyncio.wait_for(
+                self.batcher.detect(image, content_hash, full_size), self.request_timeout)
+        except asyncio.TimeoutError:
+            self._metrics.incr('requests_timed_out')
+            raise HTTPError(HTTPStatus.GATEWAY_TIMEOUT, "Detection timed out")
+        if metadata is None:
+            raise HTTPError(HTTPStatus.UNPROCESSABLE_ENTITY, "Detection failed for this image")
+
+        metadata['image_path'] = query.get('name', ['upload'])[0]
+        timing['decode_ms'] = (decoded - start) * 1000
+        timing['total_ms'] = (time.perf_counter() - start) * 1000
+        return {'result': metadata, 'timing': timing}
+
+    async def search(self, query, body):
+        if self.index is None:
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "No metadata loaded; start with --metadata")
+        try:
+            request = json.loads(body or b'{}')
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Body must be JSON")
+        if not isinstance(request, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object")
+
+        start = time.perf_counter()
+        try:
+            result = search(self.index, request)
+        except ValueError as e:
+            # A malformed query, or e.g. a spatial term against an index loaded without boxes
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+        result['timing'] = {'search_ms': (time.perf_counter() - start) * 1000}
+        return result
+
+    async def health(self, query, body):
+        health = {'status': 'ok', 'indexed_images': len(self.index) if self.index is not None else 0}
+        if self.batcher is not None:
+            health['queue'] = self.batcher.queue.qsize()
+            health['max_queue'] = self.batcher.max_queue
+        return health
+
+    async def metrics(self, query, body):
+        return self._metrics.to_prometheus()
+
+    async def _dispatch(self, method, target, body):
+        url = urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            if any(path == url.path for _, path in self.routes):
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+            raise HTTPError(HTTPStatus.NOT_FOUND)
+        return await handler(parse_qs(url.query), body)
+
+    async def _read_request(self, reader):
+        """(method, target, headers, body), or None once the client closes the connection."""
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        headers[':version'] = version
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HTTPError(HTTPStatus.LENGTH_REQUIRED, "Chunked bodies are not supported")
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+        if length > self.max_body:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target, headers, body
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    method, target, headers, body = request
+                    connection = headers.get('connection', '').lower()
+                    keep_alive = connection == 'keep-alive' or (
+                        headers[':version'] == 'HTTP/1.1' and connection != 'close')
+
+                    start = time.perf_counter()
+                    self._metrics.incr('requests')
+                    try:
+                        status, payload = HTTPStatus.OK, await self._dispatch(method, target, body)
+                    finally:
+                        self._metrics.observe('request', time.perf_counter() - start)
+                except HTTPError as e:
+                    self._metrics.incr('request_errors')
+                    status, payload = e.status, {'error': str(e)}
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    break
+                except Exception as e:
+                    self._metrics.incr('request_errors')
+                    print(f"Error handling request: {str(e)}")
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)}
+
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def _response(status, payload, keep_alive):
+    if isinstance(payload, str):
+        body = payload.encode('utf-8')
+        content_type = 'text/plain; version=0.0.4'
+    else:
+        body = json.dumps(payload).encode('utf-8')
+        content_type = 'application/json'
+    status = HTTPStatus(status)
+    head = (
+        f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+    )
+    if status == HTTPStatus.SERVICE_UNAVAILABLE:
+        head += "Retry-After: 1\r\n"
+    return head.encode('latin-1') + b"\r\n" + body
+
+
+async def serve(server, host, port):
+    await server.start(host, port)
+    print(f"Serving on http://{host}:{server.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default='config/default.yaml')
+    parser.add_argument('--host', default=None)
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--metadata', default=None, help='metadata file or .npz index to serve /search from')
+    parser.add_argument('--profile', default=None, help='inference profile from the config')
+    parser.add_argument('--search-only', action='store_true',
+                        help='serve /search without loading the model (no torch import)')
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    server_config = config.get('server') or {}
+    inferencer = None
+    if not args.search_only:
+        # Imported here: pulls in torch and ultralytics, which search-only servers never need
+        from .registry import get_inferencer_from_config
+        inferencer = get_inferencer_from_config(config, profile=args.profile)
+    metadata_path = args.metadata or server_config.get('metadata_path')
+    index = load_search_index(metadata_path) if metadata_path else None
+
+    server = DetectionServer(
+        inferencer,
+        index=index,
+        max_batch=server_config.get('max_batch', config['model'].get('batch_size', 16)),
+        max_wait_ms=server_config.get('max_wait_ms', 5),
+        max_queue=server_config.get('max_queue', 256),
+        max_body_mb=server_config.get('max_body_mb', 20),
+        request_timeout_s=server_config.get('request_timeout_s', 30),
+        decode_threads=server_config.get('decode_threads', 4)
+    )
+    host = args.host or server_config.get('host', '127.0.0.1')
+    port = args.port if args.port is not None else server_config.get('port', 8000)
+    try:
+        asyncio.run(serve(server, host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
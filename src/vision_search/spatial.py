@@ -0,0 +1,318 @@
+import numpy as np
+from pathlib import Path
+from .index import Term
+
+
+class Region(Term):
+    """Images with at least `min_count` `cls` boxes in `region`.
+
+    `region` is (x1, y1, x2, y2) in normalized [0, 1] image coordinates.
+    `mode` is 'intersects' (any overlap), 'inside' (box fully in the
+    region) or 'center' (box center in the region). `cls=None` is any class.
+    """
+
+    MODES = ('intersects', 'inside', 'center')
+
+    def __init__(self, cls, region, mode='intersects', min_count=1, min_confidence=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown region mode: {mode}")
+        super().__init__(cls, min_count=min_count, min_confidence=min_confidence)
+        self.region = tuple(float(v) for v in region)
+        self.mode = mode
+
+    def evaluate(self, index):
+        return _spatial(index)._region_ids(self)
+
+    def __repr__(self):
+        return f"Region({self.cls!r}, {self.region}, mode={self.mode!r}, min_count={self.min_count})"
+
+
+class Area(Term):
+    """Images with at least `min_count` `cls` boxes covering between `min_area` and `max_area` of the frame."""
+
+    def __init__(self, cls, min_area=0.0, max_area=1.0, min_count=1, min_confidence=None):
+        super().__init__(cls, min_count=min_count, min_confidence=min_confidence)
+        self.min_area = float(min_area)
+        self.max_area = float(max_area)
+
+    def evaluate(self, index):
+        return _spatial(index)._area_ids(self)
+
+    def __repr__(self):
+        return f"Area({self.cls!r}, min_area={self.min_area}, max_area={self.max_area}, min_count={self.min_count})"
+
+
+class Overlap(Term):
+    """Images where a `cls` box overlaps an `other` box, e.g. Overlap('person', 'car').
+
+    By default at least `min_cover` of the `cls` box must lie inside the
+    `other` box ("person inside car"); with `min_iou` the two boxes must
+    have at least that IoU instead.
+    """
+
+    def __init__(self, cls, other, min_cover=0.5, min_iou=None, min_count=1, min_confidence=None):
+        super().__init__(cls, min_count=min_count, min_confidence=min_confidence)
+        self.other = other
+        self.min_cover = float(min_cover)
+        self.min_iou = min_iou
+
+    def evaluate(self, index):
+        return _spatial(index)._overlap_ids(self)
+
+    def __repr__(self):
+        test = f"min_iou={self.min_iou}" if self.min_iou is not None else f"min_cover={self.min_cover}"
+        return f"Overlap({self.cls!r}, {self.other!r}, {test}, min_count={self.min_count})"
+
+
+def _spatial(index):
+    """Spatial predicates run on a SpatialIndex, or on the one attached to a MetadataIndex."""
+    spatial = getattr(index, 'spatial', index)
+    if spatial is None:
+        raise ValueError("This index has no spatial index; build it with spatial=True")
+    return spatial
+
+
+def _read_image_size(image_path):
+    """(width, height) from the image header, or None if the file cannot be read."""
+    from PIL import Image
+    try:
+        with Image.open(image_path) as image:
+            return image.size
+    except (OSError, ValueError):
+        return None
+
+
+def _ids_with_count(image_ids, min_count):
+    ids, counts = np.unique(image_ids, return_counts=True)
+    return ids[counts >= min_count].astype(np.int64)
+
+
+class SpatialIndex:
+    """Uniform grid over normalized detection boxes.
+
+    Every box is registered in each of the `grid_size` x `grid_size` cells it
+    touches (CSR layout: cell `c` owns `cell_rows[cell_ptr[c]:cell_ptr[c + 1]]`),
+    so a region query only tests the boxes in the cells it covers. Image ids
+    are the same as in a `MetadataIndex` built from the same metadata.
+    """
+
+    def __init__(self, image_paths, image_id, class_id, class_names, confidence, boxes, grid_size=16, grid=None):
+        self.image_paths = list(image_paths)
+        self.image_id = image_id
+        self.class_id = class_id
+        self.class_names = list(class_names)
+        self.confidence = confidence
+        self.boxes = boxes
+        self.area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        self.grid_size = int(grid_size)
+        self._class_lookup = {name: c for c, name in enumerate(self.class_names)}
+
+        # Rows of each class, in row (and so image) order
+        order = np.argsort(class_id, kind='stable')
+        self._class_rows = order
+        self._class_ptr = np.searchsorted(class_id[order], np.arange(len(self.class_names) + 1))
+        # `grid` is a saved (cell_ptr, cell_rows) pair for the same boxes and grid size
+        self.cell_ptr, self.cell_rows = grid if grid is not None else self._build_grid()
+
+    @classmethod
+    def build(cls, metadata, grid_size=16, read_missing_sizes=True):
+        """Builds the index from metadata dicts or a `DetectionStore`.
+
+        Boxes are normalized by each image's `image_size`. For images
+        without it (metadata written before it was recorded) the size is
+        read from the file header if `read_missing_sizes`; detections of
+        images whose size stays unknown are left out.
+        """
+        image_paths = []
+        class_names = {}
+        if hasattr(metadata, 'class_id'):
+            image_paths = list(metadata.image_paths)
+            class_names = {name: c for c, name in enumerate(metadata.class_names)}
+            image_id = np.asarray(metadata.image_id, dtype=np.int64)
+            class_id = np.asarray(metadata.class_id, dtype=np.int32)
+            confidence = np.asarray(metadata.confidence, dtype=np.float32)
+            boxes = np.array(metadata.bbox, dtype=np.float32).reshape(-1, 4)
+            sizes = np.array(metadata.image_size, dtype=np.float32).reshape(-1, 2)
+        else:
+            image_ids, class_ids, confidences, bboxes, sizes = [], [], [], [], []
+            for i, item in enumerate(metadata):
+                image_paths.append(item['image_path'])
+                sizes.append(item.get('image_size') or (0, 0))
+                for det in item.get('detections', []):
+                    image_ids.append(i)
+                    class_ids.append(class_names.setdefault(det['class'], len(class_names)))
+                    confidences.append(det['confidence'])
+                    bboxes.append(det['bbox'])
+            image_id = np.asarray(image_ids, dtype=np.int64)
+            class_id = np.asarray(class_ids, dtype=np.int32)
+            confidence = np.asarray(confidences, dtype=np.float32)
+            boxes = np.asarray(bboxes, dtype=np.float32).reshape(-1, 4)
+            sizes = np.asarray(sizes, dtype=np.float32).reshape(-1, 2)
+
+        if read_missing_sizes:
+            # Only images that have detections need a size
+            for i in np.unique(image_id[(sizes[image_id] <= 0).any(axis=1)]).tolist():
+                sizes[i] = _read_image_size(image_paths[i]) or (0, 0)
+
+        known = (sizes[image_id] > 0).all(axis=1)
+        if not known.all():
+            print(f"Skipping {int((~known).sum())} detections of images with an unknown size")
+        image_id, class_id, confidence, boxes = image_id[known], class_id[known], confidence[known], boxes[known]
+
+        scale = np.tile(sizes[image_id], 2)
+        boxes = np.clip(boxes / scale, 0.0, 1.0).astype(np.float32)
+        return cls(image_paths, image_id, class_id, list(class_names), confidence, boxes, grid_size)
+
+    def _cells(self, boxes):
+        """Inclusive cell ranges (cx1, cy1, cx2, cy2) that normalized boxes touch."""
+        g = self.grid_size
+        lo = np.clip((boxes[:, :2] * g).astype(np.int64), 0, g - 1)
+        hi = np.clip(np.ceil(boxes[:, 2:] * g).astype(np.int64) - 1, 0, g - 1)
+        hi = np.maximum(hi, lo)
+        return lo[:, 0], lo[:, 1], hi[:, 0], hi[:, 1]
+
+    def _build_grid(self):
+        g = self.grid_size
+        cx1, cy1, cx2, cy2 = self._cells(self.boxes)
+        nx = cx2 - cx1 + 1
+        per_row = nx * (cy2 - cy1 + 1)
+        rows = np.repeat(np.arange(len(self.boxes), dtype=np.int64), per_row)
+        local = np.arange(len(rows)) - np.repeat(np.cumsum(per_row) - per_row, per_row)
+        nx = np.repeat(nx, per_row)
+        cells = (np.repeat(cy1, per_row) + local // nx) * g + np.repeat(cx1, per_row) + local % nx
+
+        order = np.argsort(cells, kind='stable')
+        cell_ptr = np.searchsorted(cells[order], np.arange(g * g + 1))
+        return cell_ptr, rows[order].astype(np.int32)
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def all_ids(self):
+        return np.arange(len(self.image_paths), dtype=np.int64)
+
+    def _rows(self, cls, min_confidence=None):
+        """Rows of class `cls` (all rows for None), optionally above a confidence."""
+        if cls is None:
+            rows = np.arange(len(self.boxes), dtype=np.int64)
+        else:
+            c = self._class_lookup.get(cls)
+            if c is None:
+                return np.empty(0, dtype=np.int64)
+            rows = self._class_rows[self._class_ptr[c]:self._class_ptr[c + 1]]
+        if min_confidence is not None:
+            rows = rows[self.confidence[rows] >= min_confidence]
+        return rows
+
+    def _region_slices(self, region):
+        """Slices of `cell_rows` covering a normalized region, one per grid row.
+
+        The upper edges are inclusive here, so boxes that only touch the
+        region's right or bottom edge are still candidates.
+        """
+        g = self.grid_size
+        cx1, cy1 = (min(max(int(v * g), 0), g - 1) for v in region[:2])
+        cx2, cy2 = (min(max(int(v * g), 0), g - 1) for v in region[2:])
+        return [(self.cell_ptr[cy * g + cx1], self.cell_ptr[cy * g + cx2 + 1]) for cy in range(cy1, cy2 + 1)]
+
+    def _region_ids(self, term):
+        rx1, ry1, rx2, ry2 = term.region
+        rows = self._rows(term.cls, term.min_confidence)
+        # Test whichever candidate set is smaller: the class's rows or the region's cells
+        slices = self._region_slices(term.region)
+        if sum(int(end - start) for start, end in slices) < len(rows):
+            candidates = np.unique(np.concatenate([self.cell_rows[start:end] for start, end in slices]))
+            if term.cls is not None or term.min_confidence is not None:
+                candidates = candidates[np.isin(candidates, rows, assume_unique=True)]
+            rows = candidates
+
+        boxes = self.boxes[rows]
+        if term.mode == 'inside':
+            hit = (boxes[:, 0] >= rx1) & (boxes[:, 1] >= ry1) & (boxes[:, 2] <= rx2) & (boxes[:, 3] <= ry2)
+        elif term.mode == 'center':
+            cx = (boxes[:, 0] + boxes[:, 2]) / 2
+            cy = (boxes[:, 1] + boxes[:, 3]) / 2
+            hit = (cx >= rx1) & (cx <= rx2) & (cy >= ry1) & (cy <= ry2)
+        else:
+            hit = (boxes[:, 0] < rx2) & (boxes[:, 2] > rx1) & (boxes[:, 1] < ry2) & (boxes[:, 3] > ry1)
+        return _ids_with_count(self.image_id[rows[hit]], term.min_count)
+
+    def _area_ids(self, term):
+        rows = self._rows(term.cls, term.min_confidence)
+        area = self.area[rows]
+        hit = (area >= term.min_area) & (area <= term.max_area)
+        return _ids_with_count(self.image_id[rows[hit]], term.min_count)
+
+    def _overlap_ids(self, term):
+        a = self._rows(term.cls, term.min_confidence)
+        b = self._rows(term.other, term.min_confidence)
+        if len(a) == 0 or len(b) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        # Pair every `cls` box with every `other` box of the same image
+        b_images = self.image_id[b]
+        lo = np.searchsorted(b_images, self.image_id[a], side='left')
+        n = np.searchsorted(b_images, self.image_id[a], side='right') - lo
+        pa = np.repeat(a, n)
+        pb = b[np.repeat(lo, n) + np.arange(int(n.sum())) - np.repeat(np.cumsum(n) - n, n)]
+        distinct = pa != pb
+        pa, pb = pa[distinct], pb[distinct]
+
+        box_a, box_b = self.boxes[pa], self.boxes[pb]
+        w = np.clip(np.minimum(box_a[:, 2], box_b[:, 2]) - np.maximum(box_a[:, 0], box_b[:, 0]), 0, None)
+        h = np.clip(np.minimum(box_a[:, 3], box_b[:, 3]) - np.maximum(box_a[:, 1], box_b[:, 1]), 0, None)
+        inter = w * h
+        if term.min_iou is not None:
+            hit = inter / (self.area[pa] + self.area[pb] - inter + 1e-12) >= term.min_iou
+        else:
+            hit = inter / (self.area[pa] + 1e-12) >= term.min_cover
+        # Each `cls` box counts once however many boxes it overlaps
+        matched = np.unique(pa[hit])
+        return _ids_with_count(self.image_id[matched], term.min_count)
+
+    def state(self, prefix=''):
+        """Arrays describing the index, grid included, for `np.savez`."""
+        return {
+            f'{prefix}image_paths': np.array(self.image_paths, dtype=str),
+            f'{prefix}class_names': np.array(self.class_names, dtype=str),
+            f'{prefix}image_id': self.image_id,
+            f'{prefix}class_id': self.class_id,
+            f'{prefix}confidence': self.confidence,
+            f'{prefix}boxes': self.boxes,
+            f'{prefix}grid_size': self.grid_size,
+            f'{prefix}cell_ptr': self.cell_ptr,
+            f'{prefix}cell_rows': self.cell_rows
+        }
+
+    @classmethod
+    def from_state(cls, data, prefix=''):
+        """Rebuilds an index from `state` arrays; the grid is only recomputed if it was not saved."""
+        grid = None
+        if f'{prefix}cell_ptr' in data:
+            grid = (data[f'{prefix}cell_ptr'], data[f'{prefix}cell_rows'])
+        return cls(
+            data[f'{prefix}image_paths'].tolist(),
+            data[f'{prefix}image_id'],
+            data[f'{prefix}class_id'],
+            data[f'{prefix}class_names'].tolist(),
+            data[f'{prefix}confidence'],
+            data[f'{prefix}boxes'],
+            int(data[f'{prefix}grid_size']),
+            grid=grid
+        )
+
+    def save(self, path):
+        """Saves the index to a `.npz` file."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, **self.state())
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """Loads an index written by `save`."""
+        path = Path(path)
+        if not path.exists():
+            raise FileNotFoundError(f"Spatial index file not found at {path}")
+        with np.load(path) as data:
+            return cls.from_state(data)
@@ -0,0 +1,268 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import cv2
+import numpy as np
+from .backends import nms
+from .pipeline import decode_image
+from .results import DetectionResult
+
+MERGE_MODES = ('nms', 'fuse')
+
+# Bytes per pixel and BGR conversion of the raw row layouts read straight from the file
+_RAW_LAYOUTS = {
+    'L': (1, cv2.COLOR_GRAY2BGR),
+    'RGB': (3, cv2.COLOR_RGB2BGR),
+    'BGR': (3, None),
+    'RGBA': (4, cv2.COLOR_RGBA2BGR),
+    'RGBX': (4, cv2.COLOR_RGBA2BGR),
+    'BGRX': (4, cv2.COLOR_BGRA2BGR)
+}
+
+_EXIF_ORIENTATION = 0x0112
+
+_open_lock = threading.Lock()
+
+
+def _open_large(path):
+    """`Image.open` without the decompression-bomb limit, which 20K x 20K scans exceed."""
+    from PIL import Image
+
+    with _open_lock:
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            return Image.open(path)
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+
+def _raw_layout(image):
+    """(offset, row bytes, rawmode, bottom-up) of an uncompressed single-strip raster, or None."""
+    if len(image.tile) != 1:
+        return None
+    codec, extents, offset, args = image.tile[0]
+    if codec != 'raw' or tuple(extents) != (0, 0) + image.size:
+        return None
+    rawmode, stride, orientation = (args, 0, 1) if isinstance(args, str) else (tuple(args) + (0, 1))[:3]
+    if rawmode not in _RAW_LAYOUTS or orientation not in (1, -1):
+        return None
+    return offset, stride or image.size[0] * _RAW_LAYOUTS[rawmode][0], rawmode, orientation == -1
+
+
+class TileSource:
+    """An image read one band of rows at a time.
+
+    Uncompressed files (raw TIFF, PPM, BMP) are memory-mapped and a band
+    only touches its own rows, so memory is bounded by the band, not the
+    image. Compressed formats (JPEG, PNG, LZW TIFF) and files with an EXIF
+    rotation can only be decoded whole; they are decoded once, here, and
+    bands are views of that array. `size` is always that of the decoded,
+    upright image. In-memory images are used as is.
+    """
+
+    def __init__(self, source):
+        self.path = None
+        self._array = None
+        self._rows = None
+        if isinstance(source, (str, Path)):
+            self.path = Path(source)
+            try:
+                with _open_large(self.path) as image:
+                    layout = _raw_layout(image)
+                    # OpenCV applies the EXIF orientation when decoding; the raw rows are unrotated
+                    if layout is not None and image.getexif().get(_EXIF_ORIENTATION, 1) == 1:
+                        self.size = image.size
+                    else:
+                        layout = None
+            except Exception:
+                # Not something PIL reads; OpenCV may still decode it
+                layout = None
+            if layout is not None:
+                self._map_rows(*layout)
+            else:
+                self._decode_whole()
+        else:
+            self._array, _ = decode_image(source)
+            self.size = (self._array.shape[1], self._array.shape[0])
+
+    def _map_rows(self, offset, row_bytes, rawmode, bottom_up):
+        width, height = self.size
+        channels, self._convert = _RAW_LAYOUTS[rawmode]
+        rows = np.memmap(self.path, dtype=np.uint8, mode='r', offset=offset, shape=(height, row_bytes))
+        # Drop row padding and view rows as pixels; bottom-up files (BMP) store the last row first
+        rows = rows[:, :width * channels].reshape(height, width, channels)
+        self._rows = rows[::-1] if bottom_up else rows
+
+    def _decode_whole(self):
+        self._array = cv2.imdecode(np.fromfile(self.path, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if self._array is None:
+            raise ValueError(f"cannot identify image file {self.path}")
+        self.size = (self._array.shape[1], self._array.shape[0])
+
+    def band(self, y0, y1):
+        """BGR rows `y0:y1` across the full width."""
+        if self._rows is None:
+            return self._array[y0:y1]
+        band = np.ascontiguousarray(self._rows[y0:y1])
+        if self._convert is None:
+            return band
+        return cv2.cvtColor(band if band.shape[2] > 1 else band[:, :, 0], self._convert)
+
+
+def tile_starts(length, tile_size, overlap):
+    """Start offsets of tiles covering `length`; the last tile ends flush with the edge."""
+    if length <= tile_size:
+        return [0]
+    stride = max(1, tile_size - overlap)
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def iter_tiles(source, tile_size, overlap):
+    """Yields (x0, y0, BGR tile) row by row; the next band decodes while the current one is tiled."""
+    width, height = source.size
+    xs = tile_starts(width, tile_size, overlap)
+    ys = tile_starts(height, tile_size, overlap)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = pool.submit(source.band, ys[0], min(ys[0] + tile_size, height))
+        for j, y0 in enumerate(ys):
+            band = pending.result()
+            if j + 1 < len(ys):
+                pending = pool.submit(source.band, ys[j + 1], min(ys[j + 1] + tile_size, height))
+            expected = (min(y0 + tile_size, height) - y0, width)
+            if band.shape[:2] != expected:
+                raise ValueError(f"Band at row {y0} is {band.shape[1]}x{band.shape[0]}, "
+                                 f"expected {expected[1]}x{expected[0]}")
+            for x0 in xs:
+                tile = np.ascontiguousarray(band[:, x0:x0 + tile_size])
+                if tile.size == 0:
+                    raise ValueError(f"Empty tile at ({x0}, {y0}) of a {width}x{height} image")
+                yield x0, y0, tile
+            del band
+
+
+def fuse_boxes(boxes, scores, threshold):
+    """Greedy box fusion: boxes covering more than `threshold` of the smaller one merge into their union.
+
+    Returns the kept indices, highest score first, and the fused boxes.
+    Unlike IoU-based NMS this joins the pieces of an object cut by a tile
+    edge, which overlap little relative to their union.
+    """
+    order = np.argsort(-scores, kind='stable')
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    keep = []
+    fused = []
+    while order.size:
+        i = order[0]
+        rest = order[1:]
+        w = np.maximum(0.0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]))
+        h = np.maximum(0.0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]))
+        cover = w * h / (np.minimum(areas[i], areas[rest]) + 1e-9)
+        group = np.concatenate([[i], rest[cover > threshold]])
+        keep.append(i)
+        fused.append([x1[group].min(), y1[group].min(), x2[group].max(), y2[group].max()])
+        order = rest[cover <= threshold]
+    return np.asarray(keep, dtype=np.int64), np.asarray(fused, dtype=boxes.dtype).reshape(-1, 4)
+
+
+def merge_detections(boxes, scores, class_ids, iou_threshold=0.5, mode='nms'):
+    """Per-class cross-tile merge; returns kept indices and their (possibly fused) boxes."""
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64), boxes
+    # Offset each class past the largest coordinate so classes never interact
+    offsets = class_ids.astype(boxes.dtype)[:, None] * (float(boxes.max()) + 1)
+    if mode == 'fuse':
+        keep, fused = fuse_boxes(boxes + offsets, scores, iou_threshold)
+        return keep, fused - offsets[keep]
+    keep = nms(boxes + offsets, scores, iou_threshold)
+    return keep, boxes[keep]
+
+
+class Tiler:
+    """Detects on overlapping `tile_size` tiles and merges the boxes back into image coordinates.
+
+    Tiles run through the backend `batch_size` at a time; `merge` is 'nms'
+    (per-class NMS at `iou_threshold`) or 'fuse' (`fuse_boxes`, with
+    `iou_threshold` as the cover fraction). Only images whose longer side
+    exceeds `tile_size` are tiled.
+    """
+
+    def __init__(self, tile_size, overlap=128, merge='nms', iou_threshold=0.5, batch_size=8):
+        if merge not in MERGE_MODES:
+            raise ValueError(f"Unknown tile merge mode: {merge}")
+        if not 0 <= overlap < tile_size:
+            raise ValueError(f"Tile overlap must be in [0, {tile_size}), got {overlap}")
+        self.tile_size = int(tile_size)
+        self.overlap = int(overlap)
+        self.merge = merge
+        self.iou_threshold = float(iou_threshold)
+        self.batch_size = max(1, int(batch_size))
+
+    @property
+    def key(self):
+        """Settings that change the output, for the result-cache key."""
+        return f"tiles={self.tile_size}/{self.overlap}/{self.merge}/{self.iou_threshold}"
+
+    def wants(self, source):
+        """Whether `source` (a path, a decoded array or a (width, height)) is larger than one tile.
+
+        Paths only read the header.
+        """
+        if isinstance(source, np.ndarray):
+            height, width = source.shape[:2]
+        elif isinstance(source, (tuple, list)):
+            width, height = source
+        else:
+            with _open_large(source) as image:
+                width, height = image.size
+        return max(width, height) > self.tile_size
+
+    def detect(self, source, image_path, backend, conf, metrics):
+        """One compact DetectionResult for the whole image."""
+        tiles = TileSource(source)
+        width, height = tiles.size
+        boxes, scores, class_ids = [], [], []
+        names = {}
+        batch = []
+
+        def run():
+            with metrics.stage('predict'):
+                predictions = backend.predict(
+                    [tile for _, _, tile in batch],
+                    [f"{image_path}@{x0},{y0}" for x0, y0, _ in batch],
+                    conf)
+            metrics.incr('batches')
+            metrics.incr('tiles', len(batch))
+            for (x0, y0, _), (result, _) in zip(batch, predictions):
+                names.update(result.names)
+                if len(result):
+                    boxes.append(result.boxes + np.array([x0, y0, x0, y0], dtype=np.float32))
+                    scores.append(result.confidences)
+                    class_ids.append(result.class_ids)
+            batch.clear()
+
+        for tile in iter_tiles(tiles, self.tile_size, self.overlap):
+            batch.append(tile)
+            if len(batch) == self.batch_size:
+                run()
+        if batch:
+            run()
+
+        if not boxes:
+            return DetectionResult.empty(image_path, names, (width, height))
+        boxes, scores, class_ids = np.concatenate(boxes), np.concatenate(scores), np.concatenate(class_ids)
+        with metrics.stage('merge'):
+            keep, merged = merge_detections(boxes, scores, class_ids, self.iou_threshold, self.merge)
+        merged[:, [0, 2]] = merged[:, [0, 2]].clip(0, width)
+        merged[:, [1, 3]] = merged[:, [1, 3]].clip(0, height)
+        return DetectionResult(
+            image_path,
+            class_ids[keep],
+            scores[keep],
+            np.ascontiguousarray(merged, dtype=np.float32),
+            names,
+            (width, height)
+        )
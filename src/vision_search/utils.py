@@ -1,23 +1,257 @@
+import os
 import json
+import fnmatch
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 
 def save_metadata(metadata, output_path):
-    """Saves metadata to a specified JSON file."""
+    """Saves metadata to a specified JSON file.
+
+    A `.jsonl` path writes JSON Lines and a `.cols` path writes a columnar
+    `DetectionStore` directory.
+    """
     output_path = Path(output_path)
+    if output_path.suffix == '.cols':
+        from .columnar import DetectionStore
+        if not isinstance(metadata, DetectionStore):
+            metadata = DetectionStore.from_metadata(metadata)
+        return metadata.save(output_path)
+    if output_path.suffix == '.jsonl':
+        with MetadataWriter(output_path) as writer:
+            for item in metadata:
+                writer.write(item)
+        return output_path
     output_path.parent.mkdir(parents=True, exist_ok=True)
     with open(output_path, 'w') as f:
         json.dump(metadata, f, indent=2)
     return output_path
 
-def load_metadata(metadata_path):
-    """Loads metadata from a specified JSON file."""
+class MetadataWriter:
+    """Appends one JSON record per line, flushing every `flush_every` records.
+
+    Use as a context manager; `write` returns the byte offset of the record
+    so it can be read back later with `read_metadata_at`.
+    """
+
+    def __init__(self, output_path, flush_every=100, append=False):
+        self.output_path = Path(output_path)
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_every = max(1, int(flush_every))
+        self.count = 0
+        self._file = open(self.output_path, 'ab' if append else 'wb')
+
+    def write(self, item):
+        offset = self._file.tell()
+        self._file.write(json.dumps(item).encode('utf-8') + b'\n')
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self._file.flush()
+        return offset
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def iter_images(directory, extensions, recursive=True, include=None, exclude=None,
+                follow_symlinks=False, num_threads=0):
+    """Lazily yields the paths of images under `directory`, in a single pass.
+
+    Extensions match case-insensitively (`.jpg` also finds `.JPG`).
+    `include`/`exclude` are glob patterns matched against the path relative
+    to `directory`; a matching excluded directory is not descended into.
+    Each file is yielded once even if symlinks make it reachable twice.
+    With `num_threads` > 0, directories are listed in parallel, which helps
+    on network storage, and the yield order is no longer deterministic.
+    """
+    extensions = {ext.lower() for ext in extensions}
+    include = list(include or [])
+    exclude = list(exclude or [])
+    root = os.fspath(directory)
+    seen_files = set()
+    seen_dirs = set()
+
+    def matches(rel_path, patterns):
+        return any(fnmatch.fnmatch(rel_path, pattern) for pattern in patterns)
+
+    def scan(path):
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        return path, os.stat(path).st_dev, entries
+
+    def split(path, dev, entries):
+        """Filters one directory listing into (image paths, subdirectories)."""
+        files = []
+        subdirs = []
+        for entry in entries:
+            rel_path = os.path.relpath(entry.path, root).replace(os.sep, '/')
+            try:
+                if entry.is_dir(follow_symlinks=follow_symlinks):
+                    if not recursive or matches(rel_path, exclude):
+                        continue
+                    stat = entry.stat(follow_symlinks=follow_symlinks)
+                    # Symlinked directories can form loops
+                    if (stat.st_dev, stat.st_ino) not in seen_dirs:
+                        seen_dirs.add((stat.st_dev, stat.st_ino))
+                        subdirs.append(entry.path)
+                    continue
+                if not entry.is_file():
+                    continue
+                if os.path.splitext(entry.name)[1].lower() not in extensions:
+                    continue
+                if include and not matches(rel_path, include):
+                    continue
+                if exclude and matches(rel_path, exclude):
+                    continue
+                if entry.is_symlink():
+                    stat = entry.stat()
+                    key = (stat.st_dev, stat.st_ino)
+                else:
+                    key = (dev, entry.inode())
+            except OSError:
+                continue
+            if key not in seen_files:
+                seen_files.add(key)
+                files.append(entry.path)
+        return files, subdirs
+
+    root_stat = os.stat(root)
+    seen_dirs.add((root_stat.st_dev, root_stat.st_ino))
+
+    if num_threads <= 0:
+        stack = [root]
+        while stack:
+            try:
+                listing = scan(stack.pop())
+            except OSError as e:
+                print(f"Error scanning {e.filename}: {e.strerror}")
+                continue
+            files, subdirs = split(*listing)
+            yield from files
+            # Reversed so subdirectories come out in name order
+            stack.extend(reversed(subdirs))
+        return
+
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        pending = {pool.submit(scan, root)}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        listing = future.result()
+                    except OSError as e:
+                        print(f"Error scanning {e.filename}: {e.strerror}")
+                        continue
+                    files, subdirs = split(*listing)
+                    pending.update(pool.submit(scan, subdir) for subdir in subdirs)
+                    yield from files
+        finally:
+            # The caller may stop early; don't keep listing directories
+            for future in pending:
+                future.cancel()
+
+def walk_options_from_config(config):
+    """`iter_images` keyword arguments from the `data` section of default.yaml."""
+    data_config = config.get('data') or {}
+    return {
+        'recursive': data_config.get('recursive', True),
+        'include': list(data_config.get('include') or []),
+        'exclude': list(data_config.get('exclude') or []),
+        'follow_symlinks': data_config.get('follow_symlinks', False),
+        'num_threads': int(data_config.get('scan_threads') or 0)
+    }
+
+def find_images(directory, extensions, **kwargs):
+    """Lists the images under a directory; see `iter_images` for the options."""
+    return list(iter_images(directory, extensions, **kwargs))
+
+def file_hash(path, chunk_size=1 << 20):
+    """SHA-256 of a file's content, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_metadata(metadata_path, mmap_mode='r'):
+    """Loads metadata from a specified JSON file.
+
+    `.jsonl` files are read as JSON Lines. A `.cols` directory is opened as
+    a memory-mapped `DetectionStore`, which behaves like a read-only list.
+    """
     metadata_path = Path(metadata_path)
     if not metadata_path.exists():
         raise FileNotFoundError(f"Metadata file not found at {metadata_path}")
+    if metadata_path.suffix == '.cols':
+        from .columnar import DetectionStore
+        return DetectionStore.open(metadata_path, mmap_mode=mmap_mode)
+    if metadata_path.suffix == '.jsonl':
+        return list(iter_metadata(metadata_path))
     with open(metadata_path, 'r') as f:
         return json.load(f)
+
+def iter_metadata(metadata_path, where=None, start=0, offset=None):
+    """Lazily yields records from a JSON Lines metadata file.
+
+    `where` is an optional predicate on each record, `start` skips that many
+    records and `offset` seeks straight to a byte offset from `MetadataWriter`.
+    """
+    metadata_path = Path(metadata_path)
+    if not metadata_path.exists():
+        raise FileNotFoundError(f"Metadata file not found at {metadata_path}")
+    with open(metadata_path, 'rb') as f:
+        if offset is not None:
+            f.seek(offset)
+        for i, line in enumerate(f):
+            if i < start or not line.strip():
+                continue
+            item = json.loads(line)
+            if where is None or where(item):
+                yield item
+
+def metadata_offsets(metadata_path):
+    """Byte offset of every record in a JSON Lines file, without parsing them."""
+    offsets = []
+    position = 0
+    with open(metadata_path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                offsets.append(position)
+            position += len(line)
+    return offsets
+
+def read_metadata_at(metadata_path, offset):
+    """Reads the single record starting at `offset` in a JSON Lines file."""
+    with open(metadata_path, 'rb') as f:
+        f.seek(offset)
+        return json.loads(f.readline())
+
+def export_json(metadata_path, output_path):
+    """Streams a JSON Lines file out as the whole-file JSON `save_metadata` writes."""
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as f:
+        first = True
+        for item in iter_metadata(metadata_path):
+            f.write('[\n' if first else ',\n')
+            # Indent each record one level, exactly like json.dump(indent=2)
+            f.write('\n'.join('  ' + line for line in json.dumps(item, indent=2).split('\n')))
+            first = False
+        f.write('[]' if first else '\n]')
+    return output_path
         
 def get_unique_classes_counts(metadata):
+    # A MetadataIndex already has the facets in its postings
+    if hasattr(metadata, 'unique_classes_counts'):
+        return metadata.unique_classes_counts()
+
     unique_classes = set()
     count_options = {}
 
@@ -0,0 +1,212 @@
+"""Video ingestion: sampled frames are detected and stored as per-frame metadata.
+
+Frames are sampled every `stride` frames (or at `fps` frames per second),
+optionally only on a scene change. A sampled frame whose difference hash is
+within `dup_threshold` bits of the last inferred frame reuses its
+detections instead of running the model, which is most frames of static
+CCTV footage. Each record is the usual metadata dict plus `video_path`,
+`frame_index` and `timestamp` (seconds):
+
+    python -m src.vision_search.video --input data/videos --output data/processed/frames.jsonl
+"""
+
+import argparse
+from pathlib import Path
+import cv2
+import numpy as np
+from .config import load_config
+from .utils import iter_images, MetadataWriter
+
+VIDEO_EXTENSIONS = ['.mp4', '.avi', '.mov', '.mkv', '.webm', '.m4v']
+# Frame records are named `<video path>#frame=<index>`
+FRAME_SEPARATOR = '#frame='
+
+
+def frame_path(video_path, frame_index):
+    return f"{video_path}{FRAME_SEPARATOR}{frame_index}"
+
+
+def dhash(frame, size=8):
+    """64-bit difference hash of a BGR frame: brighter-than-right-neighbour bits of a 9x8 thumbnail."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(small[:, 1:] > small[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def iter_frames(video_path, stride=None, fps=None, scene_threshold=None, max_frames=None):
+    """Yields (frame_index, timestamp in seconds, BGR frame) for the sampled frames.
+
+    Every `stride`-th frame is considered, or with `fps` the stride that
+    gives about that many frames per second. Skipped frames are only
+    grabbed, not decoded. With `scene_threshold`, a considered frame is
+    kept only if its mean absolute difference from the last kept frame (on
+    a 64x36 grayscale thumbnail, 0-1) reaches the threshold.
+    """
+    capture = cv2.VideoCapture(str(video_path))
+    if not capture.isOpened():
+        raise ValueError(f"cannot open video {video_path}")
+    try:
+        native_fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+        if stride is None:
+            stride = round(native_fps / fps) if fps and native_fps else 1
+        stride = max(1, int(stride))
+
+        index = -1
+        sampled = 0
+        last_thumb = None
+        while max_frames is None or sampled < max_frames:
+            if not capture.grab():
+                break
+            index += 1
+            if index % stride:
+                continue
+            ok, frame = capture.retrieve()
+            if not ok:
+                break
+            # Container timestamps handle variable frame rates; fall back to the nominal rate
+            msec = capture.get(cv2.CAP_PROP_POS_MSEC)
+            timestamp = msec / 1000 if msec > 0 or index == 0 else index / native_fps if native_fps else 0.0
+
+            if scene_threshold is not None:
+                thumb = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (64, 36),
+                                   interpolation=cv2.INTER_AREA).astype(np.float32)
+                if last_thumb is not None and np.abs(thumb - last_thumb).mean() / 255 < scene_threshold:
+                    continue
+                last_thumb = thumb
+            sampled += 1
+            yield index, timestamp, frame
+    finally:
+        capture.release()
+
+
+def iter_video(inferencer, video_path, stride=None, fps=None, scene_threshold=None, dup_threshold=4,
+               max_frames=None, batch_size=None):
+    """Yields one metadata dict per sampled frame, in frame order.
+
+    Frames that are not near-duplicates run through `process_arrays`
+    `batch_size` at a time; near-duplicates copy the detections of the
+    last inferred frame. With `dup_threshold=None` every sampled frame is
+    inferred.
+    """
+    batch_size = max(1, int(batch_size or inferencer.batch_size))
+    video_path = str(video_path)
+    metrics = inferencer.metrics
+    batch = []
+    # (frame index, timestamp, index of the frame whose detections it uses), in order
+    pending = []
+    inferred = {}
+    last_hash = None
+    last_inferred = None
+
+    def flush():
+        if batch:
+            frames, names = zip(*batch)
+            for metadata in inferencer.process_arrays(list(frames), list(names)):
+                inferred[metadata['image_path']] = metadata
+            batch.clear()
+        for index, timestamp, source in pending:
+            metadata = inferred.get(frame_path(video_path, source))
+            if metadata is None:
+                # Its source frame failed and was reported by process_arrays
+                continue
+            record = dict(metadata)
+            record['image_path'] = frame_path(video_path, index)
+            record['video_path'] = video_path
+            record['frame_index'] = index
+            record['timestamp'] = round(timestamp, 3)
+            yield record
+        pending.clear()
+        # Only the last inferred frame can still be reused
+        for name in list(inferred):
+            if name != frame_path(video_path, last_inferred):
+                del inferred[name]
+
+    for index, timestamp, frame in iter_frames(video_path, stride, fps, scene_threshold, max_frames):
+        metrics.incr('frames')
+        if dup_threshold is not None:
+            with metrics.stage('hash'):
+                frame_hash = dhash(frame)
+            if last_hash is not None and hamming(frame_hash, last_hash) <= dup_threshold:
+                metrics.incr('frames_reused')
+                pending.append((index, timestamp, last_inferred))
+                continue
+            last_hash = frame_hash
+        last_inferred = index
+        batch.append((frame, frame_path(video_path, index)))
+        pending.append((index, timestamp, index))
+        if len(batch) == batch_size:
+            yield from flush()
+    yield from flush()
+
+
+def process_video(inferencer, video_path, **options):
+    """Like `iter_video`, as a list."""
+    return list(iter_video(inferencer, video_path, **options))
+
+
+def index_videos(inferencer, source, output_path, extensions=None, flush_every=100, **options):
+    """Streams the frame records of one video, or every video under a directory, to a JSON Lines file."""
+    source = Path(source)
+    if source.is_dir():
+        videos = iter_images(source, extensions or VIDEO_EXTENSIONS, **inferencer.walk_options)
+    else:
+        videos = [source]
+    with MetadataWriter(output_path, flush_every=flush_every) as writer:
+        for video_path in videos:
+            try:
+                for record in iter_video(inferencer, video_path, **options):
+                    writer.write(record)
+            except Exception as e:
+                inferencer._report_error(video_path, e)
+    return writer.output_path
+
+
+def video_options_from_config(config):
+    """`iter_video` keyword arguments from the `video` section of default.yaml."""
+    video_config = config.get('video') or {}
+    return {
+        'stride': video_config.get('stride'),
+        'fps': video_config.get('fps'),
+        'scene_threshold': video_config.get('scene_threshold'),
+        'dup_threshold': video_config.get('dup_threshold', 4),
+        'max_frames': video_config.get('max_frames')
+    }
+
+
+def main(argv=None):
+    from .registry import get_inferencer_from_config
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default='config/default.yaml')
+    parser.add_argument('--input', required=True, help='a video file or a directory of videos')
+    parser.add_argument('--output', default='data/processed/frames.jsonl')
+    parser.add_argument('--stride', type=int, default=None, help='consider every Nth frame')
+    parser.add_argument('--fps', type=float, default=None, help='frames per second to consider')
+    parser.add_argument('--scene-threshold', type=float, default=None)
+    parser.add_argument('--dup-threshold', type=int, default=None, help='max dHash bits for reuse')
+    parser.add_argument('--profile', default=None)
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    options = video_options_from_config(config)
+    for name in ('stride', 'fps', 'scene_threshold', 'dup_threshold'):
+        if getattr(args, name) is not None:
+            options[name] = getattr(args, name)
+    if args.stride is not None:
+        options['fps'] = None
+
+    inferencer = get_inferencer_from_config(config, profile=args.profile)
+    extensions = (config.get('video') or {}).get('extensions') or VIDEO_EXTENSIONS
+    output = index_videos(inferencer, args.input, args.output, extensions=extensions, **options)
+    counters = inferencer.metrics.counters
+    print(f"Wrote {output}: {counters.get('frames', 0)} frames, {counters.get('frames_reused', 0)} reused")
+    return output
+
+
+if __name__ == "__main__":
+    main()
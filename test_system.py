@@ -72,6 +72,499 @@ def test_inference():
         print(f"❌ Inference error: {e}")
         return False
 
+def test_backend_parity():
+    """Test that the ONNX Runtime backend matches the PyTorch backend on a fixed local model and image"""
+    print("\n🔍 Testing backend parity (torch vs onnx)...")
+    try:
+        import onnxruntime
+    except ImportError:
+        print("⚠️ onnxruntime not installed, skipping")
+        return True
+    try:
+        import tempfile
+        import cv2
+        import numpy as np
+        import torch
+        from ultralytics import YOLO
+        from src.vision_search.inference import YOLOv11Inference
+
+        with tempfile.TemporaryDirectory() as tmp:
+            # A seeded yolo11n built from its yaml, so no download; the detection head
+            # starts with near-zero class scores, so spread them to get boxes to compare
+            torch.manual_seed(0)
+            model = YOLO('yolo11n.yaml')
+            for branch in model.model.model[-1].cv3:
+                branch[-1].bias.data = torch.randn_like(branch[-1].bias) * 3
+            model_path = str(Path(tmp) / 'parity.pt')
+            model.save(model_path)
+
+            image = np.full((480, 640, 3), 114, dtype=np.uint8)
+            cv2.rectangle(image, (100, 80), (300, 400), (20, 40, 200), -1)
+            cv2.circle(image, (470, 240), 90, (200, 160, 30), -1)
+            image_path = str(Path(tmp) / 'shapes.jpg')
+            cv2.imwrite(image_path, image)
+
+            torch_model = YOLOv11Inference(model_path, 0.05, ['.jpg'], backend='torch', max_det=100)
+            onnx_model = YOLOv11Inference(model_path, 0.05, ['.jpg'], backend='onnx', max_det=100)
+            expected = torch_model.process_image(image_path)
+            actual = onnx_model.process_image(image_path)
+
+        if not expected['detections']:
+            print("❌ The parity model found nothing to compare")
+            return False
+        if len(expected['detections']) != len(actual['detections']):
+            print(f"❌ Detection counts differ: {len(expected['detections'])} vs {len(actual['detections'])}")
+            return False
+        if expected['class_counts'] != actual['class_counts']:
+            print(f"❌ Class counts differ: {expected['class_counts']} vs {actual['class_counts']}")
+            return False
+        for a, b in zip(expected['detections'], actual['detections']):
+            box_diff = max(abs(x - y) for x, y in zip(a['bbox'], b['bbox']))
+            if a['class'] != b['class'] or box_diff > 1.0 or abs(a['confidence'] - b['confidence']) > 1e-3:
+                print(f"❌ Detections differ: {a} vs {b}")
+                return False
+        print(f"✅ Backends agree on {len(expected['detections'])} detections")
+        return True
+    except Exception as e:
+        print(f"❌ Parity error: {e}")
+        return False
+
+def _synthetic_metadata(num_images=300, seed=0):
+    """Random metadata records in the format `process_directory` writes, without running a model"""
+    import numpy as np
+    from src.vision_search.results import DetectionResult
+    rng = np.random.default_rng(seed)
+    names = {0: 'person', 1: 'car', 2: 'dog'}
+    metadata = []
+    for i in range(num_images):
+        n = int(rng.integers(0, 7))
+        xy = rng.uniform(0, 560, (n, 2))
+        wh = rng.uniform(4, 160, (n, 2))
+        result = DetectionResult(
+            f"images/img_{i:04d}.jpg",
+            rng.integers(0, len(names), n).astype(np.int32),
+            rng.uniform(0.2, 1.0, n).astype(np.float32),
+            np.hstack([xy, np.minimum(xy + wh, [640, 480])]).astype(np.float32),
+            names,
+            (640, 480)
+        )
+        metadata.append(result.to_dict())
+    return metadata
+
+def _spatial_count(query, item, size=(640, 480)):
+    """Brute-force count of the boxes of one metadata record that satisfy a Region/Area/Overlap term"""
+    import numpy as np
+    from src.vision_search.spatial import Region, Area
+    dets = [det for det in item['detections']
+            if query.min_confidence is None or det['confidence'] >= query.min_confidence]
+    scale = np.array(size * 2, dtype=np.float32)
+    norm = lambda det: np.clip(np.asarray(det['bbox'], dtype=np.float32) / scale, 0.0, 1.0)
+    area = lambda b: (b[2] - b[0]) * (b[3] - b[1])
+    own = [det for det in dets if query.cls is None or det['class'] == query.cls]
+    boxes = [norm(det) for det in own]
+    if isinstance(query, Region):
+        rx1, ry1, rx2, ry2 = query.region
+        if query.mode == 'inside':
+            hit = lambda b: b[0] >= rx1 and b[1] >= ry1 and b[2] <= rx2 and b[3] <= ry2
+        elif query.mode == 'center':
+            hit = lambda b: rx1 <= (b[0] + b[2]) / 2 <= rx2 and ry1 <= (b[1] + b[3]) / 2 <= ry2
+        else:
+            hit = lambda b: b[0] < rx2 and b[2] > rx1 and b[1] < ry2 and b[3] > ry1
+        return sum(1 for b in boxes if hit(b))
+    if isinstance(query, Area):
+        return sum(1 for b in boxes if query.min_area <= area(b) <= query.max_area)
+    # Overlap: pairs of distinct boxes; each `cls` box counts once
+    count = 0
+    for det, a in zip(own, boxes):
+        for other in dets:
+            if other is det or other['class'] != query.other:
+                continue
+            b = norm(other)
+            inter = max(0.0, min(a[2], b[2]) - max(a[0], b[0])) * max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+            if query.min_iou is not None:
+                ok = inter / (area(a) + area(b) - inter + 1e-12) >= query.min_iou
+            else:
+                ok = inter / (area(a) + 1e-12) >= query.min_cover
+            if ok:
+                count += 1
+                break
+    return count
+
+def _matches(query, item):
+    """Brute-force evaluation of a Term/And/Or/Not query against one metadata record"""
+    from src.vision_search.index import And, Or, Not
+    from src.vision_search.spatial import Region, Area, Overlap
+    if isinstance(query, And):
+        return all(_matches(q, item) for q in query.queries)
+    if isinstance(query, Or):
+        return any(_matches(q, item) for q in query.queries)
+    if isinstance(query, Not):
+        return not _matches(query.query, item)
+    if isinstance(query, (Region, Area, Overlap)):
+        return _spatial_count(query, item) >= query.min_count
+    count = sum(1 for det in item['detections'] if det['class'] == query.cls and
+                (query.min_confidence is None or det['confidence'] >= query.min_confidence))
+    return count >= query.min_count and (query.max_count is None or count <= query.max_count)
+
+def test_index_queries():
+    """Test boolean and count queries of the class index against a brute-force scan"""
+    print("\n🔍 Testing index queries...")
+    try:
+        from src.vision_search.index import MetadataIndex, Term, And, Or, Not
+        metadata = _synthetic_metadata()
+        index = MetadataIndex.build(metadata)
+        queries = [
+            Term('person'),
+            Term('car', min_count=2),
+            Term('dog', max_count=0),
+            Term('person', min_count=0, max_count=1),
+            Term('car', min_confidence=0.6),
+            Term('person', min_count=2, max_count=3, min_confidence=0.5),
+            Term('person') & ~Term('car'),
+            Or(Term('dog', min_count=2), Term('car', min_count=3, min_confidence=0.4)),
+            And(Term('person'), Term('car'), Not(Term('dog', min_count=2))),
+            Term('cat'),
+            Not(Term('cat'))
+        ]
+        for query in queries:
+            expected = [item['image_path'] for item in metadata if _matches(query, item)]
+            if index.search(query) != expected:
+                print(f"❌ {query!r}: {len(index.search(query))} matches, brute force found {len(expected)}")
+                return False
+        print(f"✅ {len(queries)} queries match a brute-force scan of {len(metadata)} images")
+        return True
+    except Exception as e:
+        print(f"❌ Index query error: {e}")
+        return False
+
+def test_spatial_predicates():
+    """Test region, area and overlap queries of the spatial index against a brute-force scan, before and after save/load"""
+    print("\n🔍 Testing spatial predicates...")
+    try:
+        import tempfile
+        from src.vision_search.index import MetadataIndex, Term
+        from src.vision_search.spatial import Region, Area, Overlap
+        metadata = _synthetic_metadata()
+        index = MetadataIndex.build(metadata, spatial=True)
+        queries = [
+            Region('person', (0.0, 0.0, 0.5, 0.5)),
+            Region('car', (0.25, 0.25, 0.75, 0.75), mode='inside'),
+            Region('dog', (0.5, 0.0, 1.0, 1.0), mode='center', min_count=2),
+            Region(None, (0.9, 0.9, 1.0, 1.0), min_confidence=0.5),
+            Area('person', min_area=0.02),
+            Area('car', max_area=0.005, min_count=2),
+            Overlap('person', 'car'),
+            Overlap('dog', 'person', min_cover=0.2, min_confidence=0.4),
+            Overlap('car', 'car', min_iou=0.1),
+            Region('person', (0.0, 0.0, 1.0, 0.5)) & ~Term('dog')
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            loaded = MetadataIndex.load(index.save(Path(tmp) / 'index.npz'))
+        if loaded.spatial is None or not (loaded.spatial.cell_ptr == index.spatial.cell_ptr).all():
+            print("❌ The spatial grid did not survive save/load")
+            return False
+        for query in queries:
+            expected = [item['image_path'] for item in metadata if _matches(query, item)]
+            for name, searched in (('built', index), ('loaded', loaded)):
+                if searched.search(query) != expected:
+                    print(f"❌ {query!r} ({name}): {len(searched.search(query))} matches, "
+                          f"brute force found {len(expected)}")
+                    return False
+        print(f"✅ {len(queries)} spatial queries match a brute-force scan, also after save/load")
+        return True
+    except Exception as e:
+        print(f"❌ Spatial predicate error: {e}")
+        return False
+
+def test_vector_index_recall():
+    """Test recall@10 of the IVF and IVF-PQ vector index against exact search on clustered random vectors"""
+    print("\n🔍 Testing vector index recall...")
+    try:
+        import numpy as np
+        from src.vision_search.embeddings import VectorIndex, normalize
+        rng = np.random.default_rng(0)
+        dim, n, k = 64, 5000, 10
+        # Embeddings cluster by content; uniform noise would have no lists worth probing
+        centers = rng.normal(size=(50, dim))
+        vectors = normalize((centers[rng.integers(0, 50, n)] + 0.35 * rng.normal(size=(n, dim))).astype(np.float32))
+        queries = vectors[rng.choice(n, 100, replace=False)] + 0.2 * rng.normal(size=(100, dim))
+        queries = normalize(queries.astype(np.float32))
+        exact = np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+
+        def recall(ids):
+            return float(np.mean([len(set(found) & set(true)) / k for found, true in zip(ids.tolist(), exact.tolist())]))
+
+        flat = VectorIndex(dim, train_size=n + 1, dtype='float32')
+        flat.add(vectors)
+        if flat.is_trained or recall(flat.search(queries, k)[1]) < 1.0:
+            print("❌ Search before training is not exact")
+            return False
+
+        # Minimum recall per nprobe; PQ codes trade recall for 8x less memory than float16
+        checks = [({}, {1: 0.6, 8: 0.95, 32: 0.99}), ({'pq_m': 16}, {32: 0.5})]
+        for options, minimums in checks:
+            index = VectorIndex(dim, nlist=32, nprobe=4, train_size=2000, **options)
+            index.add(vectors[:3000])
+            index.add(vectors[3000:])
+            if not index.is_trained or len(index) != n:
+                print(f"❌ {options or 'IVF'}: index did not train on {n} vectors")
+                return False
+            recalls = {nprobe: recall(index.search(queries, k, nprobe=nprobe)[1]) for nprobe in (1, 4, 8, 32)}
+            values = list(recalls.values())
+            if any(b < a - 0.01 for a, b in zip(values, values[1:])) or \
+                    any(recalls[nprobe] < minimum for nprobe, minimum in minimums.items()):
+                print(f"❌ {options or 'IVF'}: recall@{k} by nprobe {recalls}")
+                return False
+            restored = VectorIndex.from_state(index.state('v_'), 'v_')
+            if not np.array_equal(restored.search(queries, k)[1], index.search(queries, k)[1]):
+                print(f"❌ {options or 'IVF'}: results changed after state/from_state")
+                return False
+            print(f"   {options or 'IVF'}: recall@{k} by nprobe {', '.join(f'{p}: {r:.2f}' for p, r in recalls.items())}")
+        print(f"✅ IVF and PQ recall@{k} within bounds on {n} vectors")
+        return True
+    except Exception as e:
+        print(f"❌ Vector index error: {e}")
+        return False
+
+def test_columnar_roundtrip():
+    """Test that a `.cols` store reads back the metadata it was written from, frame columns included"""
+    print("\n🔍 Testing columnar store round-trip...")
+    try:
+        import tempfile
+        from src.vision_search.utils import save_metadata, load_metadata
+        from src.vision_search.index import MetadataIndex, Term
+        metadata = _synthetic_metadata(100)
+        # Video frame records carry the optional frame columns
+        for i, item in enumerate(metadata[::10]):
+            item['image_path'] = f"videos/cam.mp4#frame={i * 15}"
+            item['video_path'] = 'videos/cam.mp4'
+            item['frame_index'] = i * 15
+            item['timestamp'] = round(i * 0.5, 3)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = save_metadata(metadata, Path(tmp) / 'metadata.cols')
+            store = load_metadata(path)
+            if list(store) != metadata:
+                bad = next(i for i, (a, b) in enumerate(zip(store, metadata)) if a != b)
+                print(f"❌ Record {bad} differs after the round-trip: {store[bad]} vs {metadata[bad]}")
+                return False
+            query = Term('person', min_count=2) & ~Term('dog')
+            if MetadataIndex.build(store).search(query) != MetadataIndex.build(metadata).search(query):
+                print("❌ Index built from the store disagrees with the one built from dicts")
+                return False
+
+            # Stores written before the frame columns existed still open
+            for name in ('frame_index', 'timestamp'):
+                (path / f"{name}.npy").unlink()
+            old = load_metadata(path)
+            if any('frame_index' in item for item in old) or old[1] != metadata[1]:
+                print("❌ Store without the optional columns did not read back as still images")
+                return False
+        print(f"✅ {len(metadata)} records survive a .cols round-trip")
+        return True
+    except Exception as e:
+        print(f"❌ Columnar store error: {e}")
+        return False
+
+def test_cache_eviction():
+    """Test the result cache's LRU memory tier and size-bounded disk tier"""
+    print("\n🔍 Testing result cache eviction...")
+    try:
+        import json
+        import time
+        import tempfile
+        from src.vision_search.cache import ResultCache
+        value = {'detections': [], 'padding': 'x' * 100}
+
+        cache = ResultCache(max_items=3)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, value)
+        cache.get('a')  # now most recently used
+        cache.put('d', value)
+        if cache.get('b') is not None or any(cache.get(key) is None for key in ('a', 'c', 'd')):
+            print("❌ Memory tier did not evict the least recently used key")
+            return False
+        cache.get('a')['detections'].append('mutated')
+        if cache.get('a')['detections']:
+            print("❌ Cached results are shared with callers")
+            return False
+
+        with tempfile.TemporaryDirectory() as tmp:
+            disk_path = Path(tmp) / 'results.sqlite'
+            # Room for four entries on disk
+            size = len(json.dumps(value).encode('utf-8'))
+            cache = ResultCache(max_items=0, disk_path=disk_path, max_disk_bytes=size * 4)
+            for i in range(4):
+                cache.put(f'k{i}', value)
+                time.sleep(0.002)
+            cache.get('k0')  # refreshes its access time
+            time.sleep(0.002)
+            cache.put('k4', value)
+            cache.close()
+
+            # Reopened from disk: the least recently accessed entry is gone
+            cache = ResultCache(max_items=0, disk_path=disk_path, max_disk_bytes=size * 4)
+            present = [key for key in ('k0', 'k1', 'k2', 'k3', 'k4') if cache.get(key) is not None]
+            stats = cache.stats()
+            cache.close()
+        if present != ['k0', 'k2', 'k3', 'k4'] or stats['disk_bytes'] > size * 4:
+            print(f"❌ Disk tier kept {present} ({stats['disk_bytes']} bytes)")
+            return False
+        print("✅ Memory and disk tiers evict least recently used entries")
+        return True
+    except Exception as e:
+        print(f"❌ Cache error: {e}")
+        return False
+
+def test_image_walker():
+    """Test the directory walker's extension case handling, filters and symlink dedupe"""
+    print("\n🔍 Testing image discovery...")
+    try:
+        import tempfile
+        from src.vision_search.utils import find_images
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            for name in ('a.jpg', 'b.JPG', 'c.Jpeg', 'notes.txt', 'sub/d.png', 'sub/deep/e.jpg', 'raw/f.jpg'):
+                (root / name).parent.mkdir(parents=True, exist_ok=True)
+                (root / name).write_bytes(b'')
+            # A second name for a.jpg and a directory loop back to the root
+            os.symlink(root / 'a.jpg', root / 'sub' / 'alias.jpg')
+            os.symlink(root, root / 'sub' / 'loop')
+
+            def found(**options):
+                paths = find_images(root, ['.jpg', '.jpeg', '.png'], **options)
+                return sorted(os.path.relpath(p, root) for p in paths), len(paths)
+
+            expected = ['a.jpg', 'b.JPG', 'c.Jpeg', 'raw/f.jpg', 'sub/d.png', 'sub/deep/e.jpg']
+            checks = [
+                (found(), expected),
+                (found(num_threads=4), expected),
+                (found(follow_symlinks=True), expected),
+                (found(recursive=False), ['a.jpg', 'b.JPG', 'c.Jpeg']),
+                (found(exclude=['raw', '*.png']), ['a.jpg', 'b.JPG', 'c.Jpeg', 'sub/deep/e.jpg']),
+                # With a.jpg filtered out, its alias is the one name left for the file
+                (found(include=['sub/*']), ['sub/alias.jpg', 'sub/d.png', 'sub/deep/e.jpg'])
+            ]
+            for (paths, count), want in checks:
+                if paths != want or count != len(want):
+                    print(f"❌ Walker found {paths} ({count} paths), expected {want}")
+                    return False
+        print(f"✅ Walker matched {len(checks)} option sets, each image once")
+        return True
+    except Exception as e:
+        print(f"❌ Walker error: {e}")
+        return False
+
+def test_video_frame_reuse():
+    """Test dhash and the near-duplicate frame reuse of iter_video on a synthetic video, without a model"""
+    print("\n🔍 Testing video frame reuse...")
+    try:
+        import tempfile
+        import cv2
+        import numpy as np
+        from src.vision_search.instrumentation import Instrumentation
+        from src.vision_search.video import dhash, hamming, iter_video
+        rng = np.random.default_rng(0)
+        # Three static scenes of ten frames each, with a little sensor noise on every frame
+        scenes = [cv2.resize(rng.integers(0, 256, (8, 9), dtype=np.uint8), (96, 96), interpolation=cv2.INTER_NEAREST)
+                  for _ in range(3)]
+        frames = [cv2.cvtColor(np.clip(scenes[i // 10] + rng.integers(-3, 4, (96, 96)), 0, 255).astype(np.uint8),
+                               cv2.COLOR_GRAY2BGR) for i in range(30)]
+
+        if hamming(dhash(frames[0]), dhash(frames[9])) > 4 or hamming(dhash(frames[0]), dhash(frames[10])) <= 4:
+            print("❌ dhash does not separate noisy copies from scene changes")
+            return False
+        if dhash(frames[0]) != dhash(cv2.add(frames[0], 20)) or hamming(dhash(frames[0]), dhash(frames[0][:, ::-1])) < 16:
+            print("❌ dhash is not brightness-invariant or not orientation-sensitive")
+            return False
+
+        class FakeInferencer:
+            """Records the frames sent for inference; a frame's detections carry its mean brightness"""
+            batch_size = 4
+
+            def __init__(self):
+                self.metrics = Instrumentation()
+                self.inferred = []
+
+            def process_arrays(self, images, names):
+                self.inferred.extend(names)
+                return [{'image_path': name, 'detections': [{'class': 'scene', 'mean': round(float(image.mean()))}]}
+                        for image, name in zip(images, names)]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            video_path = str(Path(tmp) / 'scenes.avi')
+            writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (96, 96))
+            for frame in frames:
+                writer.write(frame)
+            writer.release()
+
+            inferencer = FakeInferencer()
+            records = list(iter_video(inferencer, video_path))
+            everything = FakeInferencer()
+            all_records = list(iter_video(everything, video_path, dup_threshold=None))
+
+        indices = [record['frame_index'] for record in records]
+        sources = [f"{video_path}#frame={i}" for i in (0, 10, 20)]
+        if indices != list(range(30)) or inferencer.inferred != sources:
+            print(f"❌ Inferred {inferencer.inferred} for frames {indices}")
+            return False
+        if any(record['detections'] != records[record['frame_index'] // 10 * 10]['detections'] for record in records):
+            print("❌ A reused frame did not get the detections of its scene's first frame")
+            return False
+        if abs(records[15]['timestamp'] - 1.5) > 0.01 or records[15]['video_path'] != video_path:
+            print(f"❌ Frame fields are wrong: {records[15]}")
+            return False
+        if inferencer.metrics.counters.get('frames_reused') != 27 or len(everything.inferred) != 30 or \
+                [record['frame_index'] for record in all_records] != list(range(30)):
+            print("❌ Reuse counters or dup_threshold=None are wrong")
+            return False
+        print("✅ 3 of 30 frames inferred; the other 27 reuse their scene's detections")
+        return True
+    except Exception as e:
+        print(f"❌ Video reuse error: {e}")
+        return False
+
+def test_import_time():
+    """Test that the search-only entry point starts without torch, using `-X importtime`"""
+    print("\n🔍 Testing search-only import time...")
+    try:
+        import subprocess
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import src.vision_search.search'],
+            capture_output=True, text=True, cwd=Path(__file__).parent)
+        if proc.returncode != 0:
+            print(f"❌ Import failed: {proc.stderr.strip().splitlines()[-1]}")
+            return False
+
+        # Lines are "import time: self [us] | cumulative | imported package"; a module's
+        # imports are listed, one level more indented, just before it
+        modules, children, total_ms = [], {}, 0.0
+        for line in proc.stderr.splitlines():
+            parts = line.split('|')
+            if len(parts) != 3 or not parts[1].strip().isdigit():
+                continue
+            name, cumulative = parts[2].rstrip(), int(parts[1])
+            modules.append(name.strip())
+            if not name.startswith('  '):
+                if name.strip() == 'src.vision_search.search':
+                    total_ms = cumulative / 1000
+                    break
+                children = {}
+            elif not name.startswith('     '):
+                children[name.strip()] = cumulative
+        for name, us in sorted(children.items(), key=lambda item: -item[1])[:5]:
+            print(f"   {us / 1000:8.1f} ms  {name}")
+
+        heavy = sorted({name.split('.')[0] for name in modules} & {'torch', 'ultralytics', 'cv2'})
+        if heavy:
+            print(f"❌ Search-only import pulled in {', '.join(heavy)}")
+            return False
+        print(f"✅ Search-only import took {total_ms:.1f} ms without torch, ultralytics or cv2")
+        return True
+    except Exception as e:
+        print(f"❌ Import time error: {e}")
+        return False
+
 def main():
     print("🚀 Running comprehensive system test...\n")
     
@@ -79,7 +572,16 @@ def main():
         test_imports,
         test_config, 
         test_model,
-        test_inference
+        test_inference,
+        test_backend_parity,
+        test_index_queries,
+        test_spatial_predicates,
+        test_vector_index_recall,
+        test_columnar_roundtrip,
+        test_cache_eviction,
+        test_image_walker,
+        test_video_frame_reuse,
+        test_import_time
     ]
     
     results = []